@@ -1,65 +1,135 @@
 #! /usr/bin/env python
 
-from dataclasses import dataclass
-from rich import print
-from rich.logging import RichHandler
-import buttonClient
+# Started cold by a systemd timer, so everything before the image is on screen is kept to the bare minimum: rich, audio
+# and the button client are only imported once the image has been sent, and only the triggered alarm's files are
+# checked.
+# Pass --profile-startup to see where the time goes.
+
 import displayClient
+import json
 import logging
 import os
+import procStats
 import subprocess
 import sys
-import random
+import zmq
 
 logger = logging.getLogger(__name__)
 
+# How many of the slowest top level imports --profile-startup lists
+PROFILE_IMPORTS = 15
+
+
+SNOOZE_BUTTONS = ("A", "B")
+DISMISS_BUTTONS = ("X", "Y")
 
-@dataclass
+
+# A plain class rather than a dataclass, importing dataclasses pulls in inspect and costs more than the rest of startup
 class Config:
-    image: str = "/home/isaiah/images"
-    sound: str = "/home/isaiah/Sleepless Night 🌙.mp3"
-    snooze_min: int = 5
-    snooze_reps: int = 3
+    def __init__(
+        self,
+        days,
+        at,
+        image="/home/isaiah/images",
+        sound="/home/isaiah/Sleepless Night 🌙.mp3",
+        snooze_min=5,
+        snooze_reps=3,
+        ramp_sec=20,
+    ):
+        # When alarmDaemon.py rings, as weekdays (Monday is 0) and an (hour, minute). The systemd timers say the same.
+        self.days = days
+        self.at = at
+        self.image = image
+        self.sound = sound
+        self.snooze_min = snooze_min
+        self.snooze_reps = snooze_reps
+        # Seconds for the sound to fade in to full volume
+        self.ramp_sec = ramp_sec
+
+    def check(self, alarm_name):
+        for path in (self.image, self.sound):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{alarm_name} alarm: {path} does not exist")
 
 
 alarm_types = {
-    "sunday": Config(),
-    "workday": Config(),
+    "sunday": Config(days=(6,), at=(9, 0)),
+    "workday": Config(days=(0, 1, 2, 3, 4), at=(7, 45)),
 }
 
-for t in alarm_types.values():
-    assert os.path.exists(t.image)
-    assert os.path.exists(t.sound)
+
+def choose_image(config):
+    """The next image from config.image's index, as a copy already sized for the screen, or config.image if a file."""
+    if not os.path.isdir(config.image):
+        return config.image
+    import imageIndex
+
+    index = imageIndex.ImageIndex(config.image)
+    try:
+        return index.choose()
+    finally:
+        index.close()
+
+
+def prepare_next_image(config):
+    """Get the next image's screen sized copy made now, so the next alarm doesn't wait on it."""
+    if not os.path.isdir(config.image):
+        return
+    import imageIndex
+
+    index = imageIndex.ImageIndex(config.image)
+    try:
+        index.prepare_next()
+    finally:
+        index.close()
+
+
+def wait_for_button(buttons, player, events=()):
+    """
+    Wait for a snooze or dismiss button while the player plays, returns the button, or None if the sound ended or one
+    of events was set first. Stopping or pausing the player is left to the caller.
+    """
+    # Sleep until a button press or the sound ending, player.done becomes readable when it does
+    poller = zmq.Poller()
+    poller.register(buttons.socket, zmq.POLLIN)
+    poller.register(player.done, zmq.POLLIN)
+    for event in events:
+        poller.register(event, zmq.POLLIN)
+    while not player.done.is_set():
+        polled = dict(poller.poll())
+        if any(event.is_set() for event in events):
+            return None
+        if buttons.socket not in polled:
+            continue
+        button = buttons.get_button_event(blocking=False)
+        if button in SNOOZE_BUTTONS + DISMISS_BUTTONS:
+            return button
+    return None
 
 
 class Alarm:
     def __init__(self, alarm_name):
+        self.config = alarm_types[alarm_name]
+        self.config.check(alarm_name)
         self.display = displayClient.DisplayClient()
         self.display.connect()
-        self.config = alarm_types[alarm_name]
-        self.buttons = buttonClient.ButtonClient()
+        self.buttons = None
 
-    def trigger(self):
-        logger.info("Alarm triggered")
-        if os.path.isdir(self.config.image):
-            self.display.draw_image(
-                self.config.image
-                + "/"
-                + random.choice(
-                    list(filter(lambda i: i.endswith(".png"), os.listdir(self.config.image))),
-                ),
-            )
-        else:
-            self.display.draw_image(self.config.image)
-        play = subprocess.Popen(["play", "--no-show-progress", self.config.sound])
-
-        while play.poll() is None:
-            button = self.buttons.get_button_event(blocking=False)
-            if button in ("A", "B"):
-                self.snooze()
-                play.kill()
-            elif button in ("X", "Y"):
-                play.kill()
+    def show_image(self):
+        self.display.draw_image(choose_image(self.config))
+
+    def ring(self):
+        import audio
+        import buttonClient
+
+        self.buttons = buttonClient.ButtonClient()
+        with audio.Player(audio.open_sink()) as player:
+            player.play(audio.Clip(self.config.sound), ramp=self.config.ramp_sec)
+            prepare_next_image(self.config)
+            button = wait_for_button(self.buttons, player)
+            player.stop()
+        if button in SNOOZE_BUTTONS:
+            self.snooze()
 
     def snooze(self):
         logger.info("Alarm snoozed")
@@ -75,11 +145,76 @@ class Alarm:
         )
 
 
-if __name__ == "__main__":
+def parse_importtime(stderr):
+    """Top level imports from python -X importtime output, as (cumulative seconds, module), slowest first."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented by two spaces per level
+        if name[1:].startswith(" "):
+            continue
+        imports.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(imports, reverse=True)
+
+
+def profile_startup(alarm_name):
+    """Run the startup path in a child under -X importtime, up to the image being sent and without any sound."""
+    from rich import print
+    from rich.table import Table
+
+    child = subprocess.run(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__), alarm_name, "--startup-only"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = json.loads(child.stdout)
+    imports = parse_importtime(child.stderr)
+
+    table = Table(title=f"Slowest top level imports, {len(imports)} in total")
+    table.add_column("module")
+    table.add_column("cumulative", justify="right")
+    for seconds, name in imports[:PROFILE_IMPORTS]:
+        table.add_row(name, f"{seconds * 1000:.1f} ms")
+    table.add_row("all imports", f"{sum(seconds for seconds, name in imports) * 1000:.1f} ms")
+    print(table)
+
+    # process_age() has the kernel's clock tick resolution, 10ms on the Pi
+    print(f"Interpreter and imports done {timings['main']:.2f} s after process start")
+    print(f"Image sent and acknowledged {timings['first_frame']:.2f} s after process start")
+    print("[dim]-X importtime adds some overhead of its own, the real startup is a little faster[/dim]")
+
+
+def main(args):
+    started = procStats.process_age()
+    alarm_name = args[0]
+    if alarm_name not in alarm_types:
+        raise SystemExit(f"Unknown alarm {alarm_name}, expected one of {', '.join(alarm_types)}")
+    if "--profile-startup" in args:
+        profile_startup(alarm_name)
+        return
+
+    alarm = Alarm(alarm_name)
+    alarm.show_image()
+    first_frame = procStats.process_age()
+    if "--startup-only" in args:
+        print(json.dumps({"main": started, "first_frame": first_frame}))
+        return
+
+    # rich is one of our slowest imports, it only gets loaded once the image is up
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level=logging.DEBUG,
         handlers=[RichHandler(rich_tracebacks=True)],
     )
-    assert sys.argv[1] in alarm_types
-    alarm = Alarm(sys.argv[1])
-    alarm.trigger()
+    logger.info(f"Alarm triggered, image sent {first_frame:.2f} s after process start")
+    alarm.ring()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+
+# Rings every alarm in alarm.alarm_types from one long running process, instead of a timer starting alarm.py cold each
+# time. A minute before an alarm it picks the image and has the display server decode it, loads the decoded sound and
+# subscribes to the buttons, and the audio output is open the whole time, so at the trigger time all that's left is a
+# cached draw_image and the first period of audio. Snoozes are timers in here too, pausing the sound rather than
+# stopping it, so there can be as many as the alarm's snooze_reps allow.
+#
+#   ./alarmDaemon.py                 run the schedule
+#   ./alarmDaemon.py --test workday  prepare the workday alarm now, ring it TEST_DELAY seconds later and log latencies
+
+from rich.logging import RichHandler
+import alarm
+import audio
+import buttonClient
+import datetime
+import displayClient
+import logging
+import metrics
+import signal
+import sys
+import time
+import wakeup
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_TO_IMAGE = metrics.histogram("alarm.trigger_to_image")
+TRIGGER_TO_SOUND = metrics.histogram("alarm.trigger_to_sound")
+
+# Seconds before an alarm to get everything ready
+PREPARE_AHEAD = 60
+# How far ahead --test schedules its alarm
+TEST_DELAY = 5
+# Longest sleep towards a wall clock deadline, so a clock change (NTP, daylight saving) is noticed in time
+MAX_SLEEP = 300
+# Seconds between attempts at an alarm that failed to get ready, while there's still time before it rings
+RETRY_DELAY = 10
+
+
+def next_time(config, now):
+    """The next time config rings strictly after now, both naive local datetimes."""
+    for days_ahead in range(8):
+        day = now.date() + datetime.timedelta(days=days_ahead)
+        if day.weekday() in config.days:
+            when = datetime.datetime.combine(day, datetime.time(*config.at))
+            if when > now:
+                return when
+    raise ValueError(f"Alarm never rings: days={config.days}")
+
+
+class PreparedAlarm:
+    def __init__(self, name, config, display):
+        self.name = name
+        self.config = config
+        config.check(name)
+        self.image = alarm.choose_image(config)
+        display.warm_image(self.image)
+        self.clip = audio.Clip(config.sound)
+        # Subscribing ahead of time means no presses are lost to the subscription still connecting at trigger time
+        self.buttons = buttonClient.ButtonClient()
+
+    def close(self):
+        self.buttons.socket.close(linger=0)
+
+
+class AlarmDaemon:
+    def __init__(self):
+        self.stop = wakeup.WakeEvent()
+        self.display = displayClient.DisplayClient()
+        self.display.connect()
+        self.player = audio.Player(audio.open_sink())
+
+    def __enter__(self):
+        self.player.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.player.__exit__(exc_type, exc_value, traceback)
+        self.display.close()
+        self.stop.close()
+
+    def next_alarm(self):
+        now = datetime.datetime.now()
+        return min((next_time(config, now), name) for name, config in alarm.alarm_types.items())
+
+    def sleep_until(self, when):
+        """Sleep until a wall clock datetime, returns False if we're stopped first."""
+        while True:
+            remaining = when.timestamp() - time.time()
+            if remaining <= 0:
+                return True
+            if self.stop.wait(min(remaining, MAX_SLEEP)):
+                return False
+
+    def run(self):
+        while not self.stop.is_set():
+            when, name = self.next_alarm()
+            logger.info(f"Next alarm: {name} at {when}")
+            if not self.sleep_until(when - datetime.timedelta(seconds=PREPARE_AHEAD)):
+                break
+            # One broken alarm (a missing sound, the display server restarting) mustn't take every later one with it
+            try:
+                self.ring(name, when)
+            except Exception:
+                logger.exception(f"Alarm {name} at {when} failed")
+                # Until its time has passed next_alarm() picks the same alarm again, so this is a retry
+                if self.stop.wait(RETRY_DELAY):
+                    break
+
+    def ring(self, name, when):
+        prepared = PreparedAlarm(name, alarm.alarm_types[name], self.display)
+        logger.info(f"Prepared {name}: {prepared.image}")
+        try:
+            if not self.sleep_until(when):
+                return
+            snoozes = 0
+            while True:
+                # Drop presses from before the alarm went off
+                while prepared.buttons.get_button_event(blocking=False) is not None:
+                    pass
+                button = self.trigger(prepared, time.monotonic(), resume=snoozes > 0)
+                if button not in alarm.SNOOZE_BUTTONS or snoozes >= prepared.config.snooze_reps:
+                    break
+                self.player.pause()
+                snoozes += 1
+                logger.info(f"Snoozed {snoozes} of {prepared.config.snooze_reps} times")
+                if self.stop.wait(prepared.config.snooze_min * 60):
+                    return
+        finally:
+            self.player.stop()
+            prepared.close()
+
+    def trigger(self, prepared, triggered, resume):
+        # Sound first, the image can draw while the first period plays
+        if resume:
+            self.player.resume(ramp=prepared.config.ramp_sec)
+        else:
+            self.player.play(prepared.clip, ramp=prepared.config.ramp_sec)
+        self.display.draw_image(prepared.image)
+        to_image = time.monotonic() - triggered
+        TRIGGER_TO_IMAGE.observe(to_image)
+        if self.player.started.wait(1.0):
+            to_sound = self.player.start_time - triggered
+            TRIGGER_TO_SOUND.observe(to_sound)
+            logger.info(f"{prepared.name}: sound after {to_sound * 1000:.1f} ms, image after {to_image * 1000:.1f} ms")
+        else:
+            logger.warning(f"{prepared.name}: no sound a second after triggering")
+        return alarm.wait_for_button(prepared.buttons, self.player, [self.stop])
+
+
+def main(args):
+    with AlarmDaemon() as daemon:
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop.set())
+        if "--test" in args:
+            name = args[args.index("--test") + 1]
+            when = datetime.datetime.now() + datetime.timedelta(seconds=TEST_DELAY)
+            logger.info(f"Ringing {name} at {when}")
+            daemon.ring(name, when)
+            return
+        daemon.run()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+    metrics.serve("alarm")
+    main(sys.argv[1:])
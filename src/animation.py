@@ -0,0 +1,82 @@
+from PIL import Image, ImageSequence
+from imageCache import IMAGE_EXTENSIONS
+import logging
+import numpy
+import os
+
+logger = logging.getLogger(__name__)
+
+# Used for image sequences, and for GIF frames that don't say how long they last
+DEFAULT_FRAME_DURATION = 0.1
+
+
+class Animation:
+    """
+    Every frame of a GIF (or a directory of images) decoded, resized and converted once into a single RGB array,
+    plus the schedule for showing them.
+    """
+
+    def __init__(self, path, width, height, loops=0):
+        if os.path.isdir(path):
+            names = sorted(n for n in os.listdir(path) if n.lower().endswith(IMAGE_EXTENSIONS))
+            if not names:
+                raise ValueError(f"No images in {path}")
+            self.frames = numpy.empty((len(names), height, width, 3), dtype=numpy.uint8)
+            self.durations = [DEFAULT_FRAME_DURATION] * len(names)
+            for i, name in enumerate(names):
+                with Image.open(os.path.join(path, name)) as image:
+                    self.frames[i] = numpy.asarray(image.convert("RGB").resize((width, height)))
+        else:
+            with Image.open(path) as image:
+                count = getattr(image, "n_frames", 1)
+                self.frames = numpy.empty((count, height, width, 3), dtype=numpy.uint8)
+                self.durations = []
+                for i, frame in enumerate(ImageSequence.Iterator(image)):
+                    self.frames[i] = numpy.asarray(frame.convert("RGB").resize((width, height)))
+                    duration = frame.info.get("duration", 0) / 1000
+                    self.durations.append(duration if duration > 0 else DEFAULT_FRAME_DURATION)
+
+        self.width = width
+        self.height = height
+        # 0 plays forever, like the GIF loop extension
+        self.loops = loops
+        self.index = -1
+        self.played = 0
+        self.deadline = None
+        self.shown = 0
+        self.late = 0
+        logger.debug(f"Decoded {len(self.frames)} frames ({self.frames.nbytes} bytes) from {path}")
+
+    def finished(self):
+        return self.loops > 0 and self.played >= self.loops
+
+    def timeout(self, now):
+        """Seconds until the next frame is due."""
+        if self.deadline is None:
+            return 0
+        return max(0, self.deadline - now)
+
+    def advance(self, now):
+        """Return the frame due at now as an RGB array, or None if the current frame should stay up."""
+        if self.deadline is not None and now < self.deadline:
+            return None
+
+        self.index += 1
+        if self.index == len(self.frames):
+            self.index = 0
+            self.played += 1
+            if self.finished():
+                return None
+
+        # Schedule from the deadline rather than now so timing doesn't drift, unless we've fallen a whole frame behind
+        if self.deadline is None or now - self.deadline > self.durations[self.index]:
+            if self.deadline is not None:
+                self.late += 1
+            self.deadline = now
+        self.deadline += self.durations[self.index]
+        self.shown += 1
+
+        return self.frames[self.index]
+
+    def stats(self):
+        return {"frames": len(self.frames), "shown": self.shown, "late": self.late, "played": self.played}
@@ -0,0 +1,313 @@
+#! /usr/bin/env python
+
+# Alarm sound playback without a player process per alarm. A sound is decoded once, by sox, into raw PCM cached on
+# disk under a hash of the file, and played from a memory map by a thread that streams it to a sink one period at a
+# time. That makes stop, pause and resume take effect within a period, and lets the volume ramp up.
+#
+# The sink comes from PIRATE_ALARM_AUDIO_SINK: "alsa" (the default) writes to ALSA through pyalsaaudio when it's
+# installed and through a long running aplay otherwise, "file:<path>" writes raw PCM to a file in real time, for
+# testing without a sound card.
+#
+#   ./audio.py sound.mp3    play a sound and report decode time and start latency
+
+import fcntl
+import hashlib
+import logging
+import metrics
+import mmap
+import numpy
+import os
+import subprocess
+import sys
+import threading
+import time
+import wakeup
+
+logger = logging.getLogger(__name__)
+
+START_LATENCY = metrics.histogram("audio.start_latency")
+
+RATE = 44100
+CHANNELS = 2
+SAMPLE_BYTES = 2
+# Frames written per sink call, which bounds how quickly stop, pause and volume changes take effect. 1024 is 23 ms.
+PERIOD_FRAMES = 1024
+CACHE_DIR = os.environ.get("PIRATE_ALARM_AUDIO_CACHE", os.path.expanduser("~/.cache/pirate-alarm/audio"))
+SINK = os.environ.get("PIRATE_ALARM_AUDIO_SINK", "alsa")
+# Where a ramp starts, as a fraction of full volume
+RAMP_FLOOR = 0.05
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Clip:
+    """A sound decoded to interleaved 16 bit PCM, memory mapped from the on disk cache."""
+
+    def __init__(self, path, cache_dir=CACHE_DIR):
+        self.path = path
+        key = f"{file_hash(path)}-{RATE}-{CHANNELS}"
+        self.cache_path = os.path.join(cache_dir, key + ".pcm")
+        self.cached = os.path.exists(self.cache_path)
+        if not self.cached:
+            self.decode(cache_dir)
+
+        with open(self.cache_path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.samples = numpy.frombuffer(self.map, dtype="<i2").reshape((-1, CHANNELS))
+
+    def decode(self, cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Decode next to the cache entry and rename it into place, so a half written file is never mistaken for one
+        partial = f"{self.cache_path}.{os.getpid()}.partial"
+        command = ["sox", self.path, "-t", "raw", "-r", str(RATE), "-e", "signed", "-b", "16", "-c", str(CHANNELS)]
+        subprocess.run(command + ["-L", partial], check=True, capture_output=True)
+        os.rename(partial, self.cache_path)
+
+    @property
+    def duration(self):
+        return len(self.samples) / RATE
+
+
+class AlsaSink:
+    def __init__(self):
+        import alsaaudio
+
+        self.pcm = alsaaudio.PCM(
+            alsaaudio.PCM_PLAYBACK,
+            channels=CHANNELS,
+            rate=RATE,
+            format=alsaaudio.PCM_FORMAT_S16_LE,
+            periodsize=PERIOD_FRAMES,
+        )
+
+    def write(self, data):
+        self.pcm.write(data)
+
+    def drop(self):
+        # Throw away what's queued in the driver so a stop is heard straight away
+        if hasattr(self.pcm, "drop"):
+            self.pcm.drop()
+
+    def close(self):
+        self.pcm.close()
+
+
+class AplaySink:
+    """ALSA through an aplay that's started once and fed raw PCM, for when pyalsaaudio isn't installed."""
+
+    # Keep aplay's buffer and the pipe into it short, they hold audio that's already been written when we ramp
+    BUFFER_US = 100000
+    PIPE_SIZE = 4 * PERIOD_FRAMES * CHANNELS * SAMPLE_BYTES
+
+    def __init__(self):
+        self.process = None
+        self.start()
+
+    def start(self):
+        command = ["aplay", "-q", "-t", "raw", "-f", "S16_LE", "-r", str(RATE), "-c", str(CHANNELS)]
+        self.process = subprocess.Popen(command + ["-B", str(self.BUFFER_US)], stdin=subprocess.PIPE)
+        fcntl.fcntl(self.process.stdin, fcntl.F_SETPIPE_SZ, self.PIPE_SIZE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def drop(self):
+        # aplay can't drop what it has buffered, a fresh one is the only way to silence it now
+        self.close()
+        self.start()
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+
+
+class FileSink:
+    """Raw PCM to a file, paced like a sound card so timing behaves the same."""
+
+    def __init__(self, path):
+        self.file = open(path, "wb")
+        self.busy_until = 0.0
+
+    def write(self, data):
+        self.file.write(data)
+        # Schedule against when the "card" runs dry rather than sleeping per write, like screenHeadless does for SPI
+        now = time.perf_counter()
+        self.busy_until = max(now, self.busy_until) + len(data) / (RATE * CHANNELS * SAMPLE_BYTES)
+        # Let the first period through immediately, as a card with an empty buffer would
+        delay = self.busy_until - PERIOD_FRAMES / RATE - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def drop(self):
+        self.busy_until = 0.0
+
+    def close(self):
+        self.file.close()
+
+
+def open_sink(sink=SINK):
+    if sink.startswith("file:"):
+        return FileSink(sink[len("file:") :])
+    try:
+        return AlsaSink()
+    except ImportError:
+        logger.info("pyalsaaudio isn't installed, playing through aplay")
+        return AplaySink()
+
+
+class Player:
+    """
+    Streams one clip at a time to a sink from its own thread. done is set when the clip ends or is stopped, and can
+    be waited on with select() or zmq.Poller alongside sockets.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        # Held around every sink call, so pause() and stop() can't drop the sink in the middle of a write
+        self.sink_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.clip = None
+        self.position = 0
+        self.playing = False
+        self.closing = False
+        # Frames into the current ramp, and how many it lasts
+        self.ramp_position = 0
+        self.ramp_frames = 0
+        self.requested = None
+        self.start_time = None
+        self.started = threading.Event()
+        self.done = wakeup.WakeEvent()
+        self.frame_indices = numpy.arange(PERIOD_FRAMES, dtype=numpy.float32)
+        self.gains = numpy.empty(PERIOD_FRAMES, dtype=numpy.float32)
+        self.scaled = numpy.empty((PERIOD_FRAMES, CHANNELS), dtype=numpy.float32)
+        self.period = numpy.empty((PERIOD_FRAMES, CHANNELS), dtype="<i2")
+        self.thread = threading.Thread(target=self.thread_main, name="audio", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join()
+        self.sink.close()
+        self.done.close()
+
+    def play(self, clip, ramp=0.0):
+        """Play clip from the start, fading in over ramp seconds."""
+        with self.condition:
+            self.clip = clip
+            self.position = 0
+            self.start(ramp)
+
+    def resume(self, ramp=0.0):
+        """Carry on from where pause() left off."""
+        with self.condition:
+            if self.clip is not None and self.position < len(self.clip.samples):
+                self.start(ramp)
+
+    def start(self, ramp):
+        self.ramp_position = 0
+        self.ramp_frames = int(ramp * RATE)
+        self.requested = time.monotonic()
+        self.start_time = None
+        self.started.clear()
+        self.done.clear()
+        self.playing = True
+        self.condition.notify()
+
+    def pause(self):
+        with self.sink_lock:
+            with self.condition:
+                self.playing = False
+            self.sink.drop()
+
+    def stop(self):
+        with self.sink_lock:
+            with self.condition:
+                self.playing = False
+                self.clip = None
+            self.sink.drop()
+        self.done.set()
+
+    def start_latency(self):
+        """Seconds from the last play() or resume() to its first period reaching the sink, once it has."""
+        if self.start_time is None:
+            return None
+        return self.start_time - self.requested
+
+    def next_period(self):
+        # Called with the condition held, returns the next period ready to write, or None at the end of the clip
+        frames = self.clip.samples[self.position : self.position + PERIOD_FRAMES]
+        count = len(frames)
+        if count == 0:
+            return None
+        self.position += count
+        if self.ramp_position >= self.ramp_frames:
+            return frames
+
+        # Linear fade in, computed into the preallocated buffers so a ramp doesn't allocate per period
+        gains = self.gains[:count]
+        numpy.add(self.frame_indices[:count], self.ramp_position, out=gains)
+        gains *= (1.0 - RAMP_FLOOR) / self.ramp_frames
+        gains += RAMP_FLOOR
+        numpy.minimum(gains, 1.0, out=gains)
+        self.ramp_position += count
+        scaled = self.scaled[:count]
+        numpy.multiply(frames, gains[:, None], out=scaled)
+        period = self.period[:count]
+        period[...] = scaled
+        return period
+
+    def thread_main(self):
+        while True:
+            with self.condition:
+                while not (self.playing or self.closing):
+                    self.condition.wait()
+                if self.closing:
+                    return
+                period = self.next_period()
+                if period is None:
+                    self.playing = False
+                    self.done.set()
+                    continue
+                first = self.start_time is None
+
+            # Outside the condition: the write blocks for about a period once the sink's buffer is full
+            with self.sink_lock:
+                # A pause or stop since the period was taken means it's no longer wanted
+                if not self.playing:
+                    continue
+                self.sink.write(period.tobytes())
+            if first:
+                self.start_time = time.monotonic()
+                START_LATENCY.observe(self.start_time - self.requested)
+                self.started.set()
+
+
+def main(args):
+    path = args[0]
+    start = time.perf_counter()
+    clip = Clip(path)
+    decoded = time.perf_counter() - start
+    print(f"{'Loaded cached' if clip.cached else 'Decoded'} {clip.duration:.1f} s of audio in {decoded * 1000:.1f} ms")
+
+    with Player(open_sink()) as player:
+        player.play(clip, ramp=2.0)
+        player.started.wait()
+        print(f"Sound started {player.start_latency() * 1000:.1f} ms after play()")
+        player.done.wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
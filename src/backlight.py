@@ -1,16 +1,199 @@
 #! /usr/bin/env python
 
-import gpiod
-import gpiodevice
+# Backlight brightness for the display server, and run on its own at boot to turn the backlight off until the display
+# server starts.
 
-from gpiod.line import Direction, Value
+import bisect
+import datetime
+import logging
+import os
+import threading
+import time
 
+logger = logging.getLogger(__name__)
+
+# Brightness by hour of the day, straight lines between the points and wrapping around midnight
+DEFAULT_CURVE = [(6.5, 0.2), (7.5, 1.0), (20.0, 1.0), (22.0, 0.2)]
+FADE_SECONDS = 0.5
+# Fades are a step per FADE_STEP, fine enough that the eye doesn't see the steps
+FADE_STEP = 1 / 50
+# How often the curve is looked at again while the screen is on
+CURVE_INTERVAL = 60.0
+# Brightness is perceptual, the duty cycle that gives it goes as the power
+GAMMA = 2.2
+SOFT_PWM_HZ = 200
+
+
+class Curve:
+    def __init__(self, points=DEFAULT_CURVE):
+        if not points:
+            raise ValueError("A brightness curve needs at least one point")
+        self.points = sorted((hour % 24, min(1.0, max(0.0, level))) for hour, level in points)
+        self.hours = [hour for hour, _ in self.points]
+
+    def level(self, when):
+        hour = when.hour + when.minute / 60 + when.second / 3600
+        after = bisect.bisect_right(self.hours, hour)
+        start_hour, start_level = self.points[after - 1] if after > 0 else self.points[-1]
+        end_hour, end_level = self.points[after] if after < len(self.points) else self.points[0]
+        span = (end_hour - start_hour) % 24
+        if span == 0:
+            return start_level
+        return start_level + (end_level - start_level) * ((hour - start_hour) % 24) / span
+
+
+class Backlight:
+    """
+    When and how bright the backlight is, with no thread of its own. The owner calls advance() at the deadlines
+    timeout() asks for and wake() on activity: the backlight follows the curve while awake, fades out after timeout
+    seconds without a wake() and is then dark until the next one.
+    """
+
+    def __init__(self, set_brightness, curve, timeout, fade_seconds=FADE_SECONDS, now=None):
+        self.set_brightness = set_brightness
+        self.curve = curve
+        self.idle_timeout = timeout
+        self.fade_seconds = fade_seconds
+        now = time.monotonic() if now is None else now
+        self.awake = True
+        self.idle_deadline = now + timeout
+        self.curve_deadline = now
+        self.level = None
+        self.fade = None
+
+    def dark(self):
+        return not self.awake and self.fade is None
+
+    def wake(self, now):
+        self.idle_deadline = now + self.idle_timeout
+        if not self.awake:
+            self.awake = True
+            self.curve_deadline = now
+
+    def fade_to(self, target, now):
+        if self.level is None or self.fade_seconds <= 0:
+            self.fade = None
+            self.show(target)
+        elif target != self.level and (self.fade is None or self.fade[3] != target):
+            self.fade = (now, now + self.fade_seconds, self.level, target)
+
+    def show(self, level):
+        if level != self.level:
+            self.level = level
+            self.set_brightness(level**GAMMA)
+
+    def advance(self, now):
+        if self.awake and now >= self.idle_deadline:
+            logger.debug(f"No activity for {self.idle_timeout} s, fading out")
+            self.awake = False
+            self.fade_to(0.0, now)
+        if self.awake and now >= self.curve_deadline:
+            self.curve_deadline = now + CURVE_INTERVAL
+            self.fade_to(self.curve.level(datetime.datetime.now()), now)
+
+        if self.fade is not None:
+            start, end, start_level, end_level = self.fade
+            if now >= end:
+                self.fade = None
+                self.show(end_level)
+            else:
+                self.show(start_level + (end_level - start_level) * (now - start) / (end - start))
+
+    def timeout(self, now):
+        """Seconds until advance() has something to do, or None once the backlight is dark."""
+        deadlines = []
+        if self.fade is not None:
+            deadlines.append(min(self.fade[1], now + FADE_STEP))
+        if self.awake:
+            deadlines.extend((self.idle_deadline, self.curve_deadline))
+        return max(0.0, min(deadlines) - now) if deadlines else None
+
+
+class HardwarePwm:
+    """
+    A PWM channel through sysfs, which needs the pin handed to the PWM block first, for the Pirate Audio backlight on
+    GPIO 13 that's dtoverlay=pwm,pin=13,func=4 in config.txt.
+    """
+
+    def __init__(self, chip, channel, frequency):
+        self.path = f"/sys/class/pwm/pwmchip{chip}/pwm{channel}"
+        if not os.path.exists(self.path):
+            with open(f"/sys/class/pwm/pwmchip{chip}/export", "w") as export:
+                export.write(str(channel))
+        self.period = int(1e9 / frequency)
+        # The duty cycle has to fit in the period before the period can shrink, so clear it first
+        self.write("duty_cycle", 0)
+        self.write("period", self.period)
+        self.write("enable", 1)
+
+    def write(self, name, value):
+        with open(os.path.join(self.path, name), "w") as attribute:
+            attribute.write(str(value))
+
+    def set(self, duty):
+        self.write("duty_cycle", int(duty * self.period))
+
+    def close(self):
+        self.write("enable", 0)
+
+
+class SoftPwm:
+    """
+    PWM by toggling a pin from a thread, for when the PWM block isn't free. The thread only runs while the duty cycle
+    is strictly between off and full, and timing jitter shows as flicker when the CPU is busy.
+    """
+
+    def __init__(self, set_pin, frequency=SOFT_PWM_HZ):
+        self.set_pin = set_pin
+        self.period = 1 / frequency
+        self.duty = 1.0
+        self.changed = threading.Event()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.thread_main, daemon=True)
+        self.thread.start()
+
+    def set(self, duty):
+        self.duty = duty
+        self.changed.set()
+
+    def close(self):
+        self.stop.set()
+        self.changed.set()
+        self.thread.join()
+
+    def thread_main(self):
+        while not self.stop.is_set():
+            self.changed.clear()
+            duty = self.duty
+            if duty <= 0 or duty >= 1:
+                self.set_pin(duty > 0)
+                self.changed.wait()
+                continue
+            self.set_pin(True)
+            self.changed.wait(self.period * duty)
+            self.set_pin(False)
+            self.changed.wait(self.period * (1 - duty))
+
+
+def set_backlight(enabled, pin):
+    import gpiod
+    import gpiodevice
+    from gpiod.line import Direction, Value
 
-def set_backlight(enabled):
     output_value = Value.ACTIVE if enabled else Value.INACTIVE
     output = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=output_value)
-    backlight = gpiodevice.get_pin(13, "backlight-ctrl", output)
+    gpiodevice.get_pin(pin, "backlight-ctrl", output)
+
+
+def main():
+    import displayBackend
+
+    config = displayBackend.load_config()
+    if config["backlight_pwm"] == "hardware":
+        HardwarePwm(config["pwm_chip"], config["pwm_channel"], config["pwm_hz"]).set(0)
+    else:
+        set_backlight(False, config["backlight"])
 
 
 if __name__ == "__main__":
-    set_backlight(False)
+    main()
@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+# Sustained frames per second when streaming raw pixels with draw_frame, against writing each frame to a PNG file and
+# sending draw_image. Pass --local to host a display server in this process, which also reports frames rendered.
+
+from benchFramebuffer import NullDisplay
+from PIL import Image
+from rich import print
+import displayClient
+import displayServer
+import numpy
+import os
+import sys
+import tempfile
+import threading
+import time
+
+SECONDS = 5
+
+
+def make_frames(count):
+    frames = []
+    for i in range(count):
+        image = Image.new("RGB", (displayServer.WIDTH, displayServer.HEIGHT), (i * 8 % 256, 64, 255 - i * 8 % 256))
+        frames.append(image)
+    return frames
+
+
+def to_rgb565(image):
+    rgb = numpy.asarray(image).astype(numpy.uint16)
+    packed = ((rgb[..., 0] & 0xF8) << 8) | ((rgb[..., 1] & 0xFC) << 3) | (rgb[..., 2] >> 3)
+    return packed.astype(">u2").tobytes()
+
+
+def measure(name, compositor, send):
+    frames_before = compositor.frames_rendered if compositor else 0
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < SECONDS:
+        send(count)
+        count += 1
+    elapsed = time.perf_counter() - start
+    report = f"{name:<20} sent: {count / elapsed:8.1f} FPS"
+    if compositor:
+        report += f"    rendered: {(compositor.frames_rendered - frames_before) / elapsed:8.1f} FPS"
+    print(report)
+
+
+def bench(compositor):
+    client = displayClient.DisplayClient()
+    client.connect()
+    images = make_frames(32)
+
+    rgb = [image.tobytes() for image in images]
+    measure("draw_frame rgb", compositor, lambda i: client.draw_frame(rgb[i % len(rgb)], "rgb"))
+
+    rgb565 = [to_rgb565(image) for image in images]
+    measure("draw_frame rgb565", compositor, lambda i: client.draw_frame(rgb565[i % len(rgb565)], "rgb565"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "frame.png")
+
+        def send_file(i):
+            images[i % len(images)].save(path)
+            client.draw_image(path)
+
+        measure("draw_image png", compositor, send_file)
+
+
+def main(args):
+    if "--local" not in args:
+        bench(None)
+        return
+
+    # Lift the frame cap so the numbers show what the pipeline can sustain, not MAX_FPS
+    with displayServer.Compositor(NullDisplay(), max_fps=1000) as compositor:
+        with displayServer.Server(compositor) as server:
+            thread = threading.Thread(target=server.run)
+            thread.start()
+            try:
+                bench(compositor)
+            finally:
+                compositor.stop.set()
+                thread.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+
+# Compare the CPU cost per frame of the old compose path (alpha_composite a fresh RGBA frame, then let the st7789
+# driver convert it to RGB565) against the persistent RGB565 framebuffer. No SPI traffic is involved, so this
+# measures only the work our code does before the bytes hit the bus.
+#
+# It ends with a steady state allocation check, which exits with status 1 if a frame allocates more than
+# STEADY_STATE_ALLOCATION, so a change that brings back per-frame buffers fails rather than just printing slower.
+#
+#   ./benchFramebuffer.py [frames]                  timings, then the allocation check
+#   ./benchFramebuffer.py [frames] --allocations    only the allocation check
+
+from PIL import Image
+from rich import print
+import displayBackend
+import displayServer
+import numpy
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+
+# Less than the smallest array a frame could need (the icon bar's rows are 45 KiB), anything over this means a frame
+# allocated pixel buffers rather than reusing them
+STEADY_STATE_ALLOCATION = 16 * 1024
+# Frames rendered before measuring. Besides filling our caches this has to fill CPython's free lists, up to 2000 tuples
+# of each size, which tracemalloc counts as allocated until they're full
+WARMUP_FRAMES = 2500
+
+
+class NullDisplay(displayBackend.Backend):
+    def display(self, image):
+        pass
+
+    def display_buffer(self, framebuffer, box):
+        # Read every byte the driver would send, without copying them as a bytes() would
+        zlib.crc32(framebuffer.window(box))
+
+    def set_backlight(self, enabled):
+        pass
+
+
+def image_to_data(image, rotation):
+    # Same conversion st7789.ST7789.image_to_data() does on every frame
+    pb = numpy.rot90(numpy.array(image.convert("RGB")), rotation // 90).astype("uint16")
+    red = (pb[..., [0]] & 0xF8) << 8
+    green = (pb[..., [1]] & 0xFC) << 3
+    blue = (pb[..., [2]] & 0xF8) >> 3
+    return (red | green | blue).byteswap().tobytes()
+
+
+def measure(name, frames, render):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(frames):
+        frame_start = time.perf_counter()
+        render(i)
+        latencies.append(time.perf_counter() - frame_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(
+        f"{name:<32} FPS: {frames / elapsed:8.1f}    "
+        f"mean: {statistics.mean(latencies) * 1000:6.2f} ms    "
+        f"p50: {latencies[len(latencies) // 2] * 1000:6.2f} ms    "
+        f"p99: {latencies[int(len(latencies) * 0.99)] * 1000:6.2f} ms"
+    )
+
+
+def layer_image(layer):
+    # A full screen copy of a layer for the PIL baseline, premultiplied but it's the cost being measured
+    image = Image.new("RGBA", (displayServer.WIDTH, displayServer.HEIGHT))
+    image.paste(Image.fromarray(layer.pixels, "RGBA"), layer.box[:2])
+    return image
+
+
+def allocations(name, frames, render):
+    """
+    Peak and retained Python and numpy memory allocated while rendering frames, after a first pass to fill the
+    caches. Returns whether both stayed within STEADY_STATE_ALLOCATION.
+    """
+    for i in range(max(frames, WARMUP_FRAMES)):
+        render(i)
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(frames):
+        render(i)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    ok = max(peak, current) - baseline < STEADY_STATE_ALLOCATION
+    verdict = "ok" if ok else "[red]allocates[/red]"
+    print(f"{name:<32} peak: {peak - baseline:8d} B    retained: {current - baseline:8d} B    {verdict}")
+    return ok
+
+
+def main(frames, timings=True):
+    width, height = displayServer.WIDTH, displayServer.HEIGHT
+    noise = Image.effect_noise((width, height), 64).convert("RGBA")
+    compositor = displayServer.Compositor(NullDisplay())
+    compositor.draw_frame(noise.convert("RGB").tobytes(), "rgb")
+    compositor.draw_icon("alarm", "note")
+    compositor.render()
+    symbols = ["connected", "disconnected", "wait"]
+    icons = [Image.open(f"../images/icon_wifi_{symbol}.png").convert("RGBA") for symbol in symbols]
+
+    def legacy_full(i):
+        image_to_data(Image.alpha_composite(noise, icons[0]), displayServer.ROTATION)
+
+    def legacy_icon(i):
+        image_to_data(Image.alpha_composite(noise, icons[i % 3]), displayServer.ROTATION)
+
+    def framebuffer_full(i):
+        compositor.add_damage(displayServer.FULL_FRAME, "background")
+        compositor.render()
+
+    def framebuffer_icon(i):
+        compositor.draw_icon("wifi", symbols[i % 3])
+        compositor.render()
+
+    if timings:
+        measure("alpha_composite + image_to_data", frames, legacy_full)
+        measure("framebuffer, full frame", frames, framebuffer_full)
+        measure("alpha_composite, icon change", frames, legacy_icon)
+        measure("framebuffer, icon change", frames, framebuffer_icon)
+
+    # Every layer in use, to show changes high in the stack don't pay for the layers under them
+    overlay = Image.new("RGBA", (width, height))
+    overlay.paste((255, 0, 0, 96), (20, 60, 220, 200))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "overlay.png")
+        overlay.save(path)
+        compositor.draw_overlay(path)
+    compositor.draw_text("clock", "07:45", 60, 100, 40, "white")
+    compositor.show_toast("Snoozed for 5 minutes", 60)
+    compositor.render()
+    layers = [layer_image(layer) for layer in compositor.layers.layers if not layer.empty]
+
+    def every_layer(i):
+        frame = layers[0]
+        for layer in layers[1:]:
+            frame = Image.alpha_composite(frame, layer)
+        image_to_data(frame, displayServer.ROTATION)
+
+    def every_layer_icon(i):
+        compositor.draw_icon("wifi", symbols[i % 3])
+        every_layer(i)
+
+    def every_layer_clock(i):
+        compositor.draw_text("clock", f"07:{i % 60:02d}", 60, 100, 40, "white")
+        every_layer(i)
+
+    def stack_clock(i):
+        compositor.draw_text("clock", f"07:{i % 20:02d}", 60, 100, 40, "white")
+        compositor.render()
+
+    if timings:
+        measure("5 layers composited, icon change", frames, every_layer_icon)
+        measure("layer stack, icon change", frames, framebuffer_icon)
+        measure("5 layers composited, clock change", frames, every_layer_clock)
+        measure("layer stack, clock change", frames, stack_clock)
+
+    # Once the icon bars and text strips are cached, a frame should only reuse buffers
+    rgb_frames = [Image.effect_noise((width, height), 32 + i).convert("RGB").tobytes() for i in range(4)]
+    compositor.scroll_text("ticker", "Wake up, the coffee is on", 150, 30, "white", 100)
+    start = compositor.text.items["ticker"].start
+
+    def ticker(i):
+        compositor.advance_text(start + i / displayServer.MAX_FPS)
+        compositor.render()
+
+    def draw_frame(i):
+        compositor.draw_frame(rgb_frames[i % len(rgb_frames)], "rgb")
+        compositor.render()
+
+    checks = [
+        allocations("icon change", frames, framebuffer_icon),
+        allocations("clock change", frames, stack_clock),
+        allocations("ticker frame", frames, ticker),
+        allocations("draw_frame rgb", frames, draw_frame),
+    ]
+    if not all(checks):
+        print(f"[red]A steady state frame allocated more than {STEADY_STATE_ALLOCATION} bytes[/red]")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    main(int(args[0]) if args else 500, timings="--allocations" not in sys.argv)
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+
+# End to end benchmark of DisplayClient -> zmq -> Server.handle_message -> Compositor -> backend, run against the
+# headless backend so it works anywhere. Each workload mimics one of our services, and the results can be saved as
+# JSON and compared against a previous run:
+#
+#   ./benchPipeline.py --output before.json
+#   ./benchPipeline.py --output after.json --compare before.json
+
+import os
+
+os.environ.setdefault("PIRATE_ALARM_DISPLAY", "headless")
+
+from rich import print
+import argparse
+import displayClient
+import displayServer
+import icons
+import json
+import random
+import subprocess
+import threading
+import time
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+
+def icon_flap(client, i, images):
+    # WifiMonitor.initial_connection while the network is down
+    client.draw_icon(icons.WIFI_DISCONNECTED if i % 2 else icons.WIFI_WAIT)
+
+
+def image_cycle(client, i, images):
+    # An alarm going off with a random image
+    client.draw_image(random.choice(images))
+
+
+def backlight_ping(client, i, images):
+    # ButtonServer on every press
+    client.backlight()
+
+
+WORKLOADS = {
+    "icon_flap": icon_flap,
+    "image_cycle": image_cycle,
+    "backlight_ping": backlight_ping,
+}
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Pipeline:
+    def __init__(self):
+        self.display = displayServer.open_display()
+        self.compositor = displayServer.Compositor(self.display)
+        self.server = displayServer.Server(self.compositor)
+
+    def __enter__(self):
+        self.compositor.__enter__()
+        self.server.__enter__()
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.start()
+        # Get the first full frame out of the way so it isn't billed to whichever workload runs first
+        self.compositor.redraw()
+        self.settle()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.compositor.stop.set()
+        self.thread.join()
+        self.server.__exit__(exc_type, exc_value, traceback)
+        self.compositor.__exit__(exc_type, exc_value, traceback)
+        self.display.__exit__(exc_type, exc_value, traceback)
+
+    def render_cpu_time(self):
+        return time.clock_gettime(time.pthread_getcpuclockid(self.compositor.render_thread.ident))
+
+    def settle(self):
+        # Wait for the render thread to push everything that's been queued
+        frames = -1
+        while frames != self.compositor.frames_rendered or self.compositor.render_request.is_set():
+            frames = self.compositor.frames_rendered
+            time.sleep(0.1)
+
+
+def run_workload(pipeline, client, workload, requests, interval, images):
+    pipeline.settle()
+    frames = pipeline.compositor.frames_rendered
+    sent = pipeline.display.screen.bytes_sent
+    cpu = pipeline.render_cpu_time()
+    latencies = []
+
+    start = time.perf_counter()
+    for i in range(requests):
+        request_start = time.perf_counter()
+        workload(client, i, images)
+        latencies.append(time.perf_counter() - request_start)
+        if interval:
+            time.sleep(interval)
+    pipeline.settle()
+    elapsed = time.perf_counter() - start
+
+    frames = pipeline.compositor.frames_rendered - frames
+    cpu = pipeline.render_cpu_time() - cpu
+    latencies.sort()
+    return {
+        "requests": requests,
+        "elapsed_s": elapsed,
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+        "frames": frames,
+        "bytes": pipeline.display.screen.bytes_sent - sent,
+        "render_cpu_ms_per_frame": cpu / frames * 1000 if frames else 0.0,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline):
+    print(f"Comparing against {baseline.get('commit')}")
+    for name, metrics in results["workloads"].items():
+        if name not in baseline["workloads"]:
+            continue
+        print(f"[bold]{name}[/bold]")
+        for metric, value in metrics.items():
+            old = baseline["workloads"][name].get(metric)
+            if not old:
+                continue
+            print(f"  {metric:<24} {old:12.3f} -> {value:12.3f}  ({(value - old) / old * 100:+6.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End to end display pipeline benchmark")
+    parser.add_argument("--requests", type=int, default=500, help="requests per workload")
+    parser.add_argument("--interval", type=float, default=0.0, help="seconds between requests")
+    parser.add_argument("--images", default="../images", help="directory image_cycle picks from")
+    parser.add_argument("--workload", action="append", choices=WORKLOADS, help="only run these workloads")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--compare", help="compare against results saved by an earlier run")
+    args = parser.parse_args()
+
+    images = [os.path.join(args.images, name) for name in os.listdir(args.images) if name.endswith(IMAGE_EXTENSIONS)]
+    random.seed(0)
+
+    results = {
+        "commit": git_commit(),
+        "time": time.time(),
+        "requests": args.requests,
+        "interval": args.interval,
+        "workloads": {},
+    }
+    with Pipeline() as pipeline:
+        results["spi_speed_hz"] = pipeline.display.screen.spi_speed_hz
+        client = displayClient.DisplayClient()
+        client.connect()
+        for name in args.workload or WORKLOADS:
+            results["workloads"][name] = run_workload(
+                pipeline, client, WORKLOADS[name], args.requests, args.interval, images
+            )
+            print(name, results["workloads"][name])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
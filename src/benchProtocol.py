@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+# Commands per second over the "display" endpoint for each protocol, one command per round trip and batched.
+# Talks to the running display server, or pass --local to host one in this process with a display that drops frames.
+
+from benchFramebuffer import NullDisplay
+from rich import print
+import displayClient
+import displayProtocol
+import displayServer
+import json
+import sys
+import threading
+import time
+
+BATCH_SIZE = 32
+
+
+def workload(client, count):
+    for i in range(count):
+        if i % 2:
+            client.backlight()
+        else:
+            client.draw_icon("wifi_connected")
+
+
+def measure(name, count, run):
+    start = time.perf_counter()
+    run(count)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {count / elapsed:10.0f} commands/sec    {elapsed / count * 1e6:8.1f} us/command")
+
+
+def bench_encoding(count):
+    command = {"command": "icon_bar_color", "r": 86, "g": 142, "b": 215, "a": 200}
+    # Only parse() is used, which never touches the compositor
+    server = displayServer.Server(None)
+
+    def json_codec(n):
+        for _ in range(n):
+            server.parse(str.encode(json.dumps(command)))
+
+    def binary_codec(n):
+        for _ in range(n):
+            frames = displayProtocol.encode(command)
+            displayProtocol.decode(frames[0], iter(frames[1:]))
+
+    measure("json encode+parse", count, json_codec)
+    measure("binary encode+decode", count, binary_codec)
+
+
+def bench_socket(count):
+    for protocol in (displayProtocol.JSON, displayProtocol.BINARY):
+        client = displayClient.DisplayClient(protocol=protocol)
+        client.connect()
+        client.backlight()
+        assert client.protocol == protocol, f"server negotiated {client.protocol} instead of {protocol}"
+
+        measure(f"{protocol}", count, lambda n: workload(client, n))
+
+        def batched(n):
+            for _ in range(n // BATCH_SIZE):
+                with client.batch():
+                    workload(client, BATCH_SIZE)
+
+        measure(f"{protocol} batch of {BATCH_SIZE}", count, batched)
+
+
+def main(args):
+    count = 20000
+    if "--local" not in args:
+        bench_encoding(count)
+        bench_socket(count)
+        return
+
+    with displayServer.Compositor(NullDisplay()) as compositor:
+        with displayServer.Server(compositor) as server:
+            thread = threading.Thread(target=server.run)
+            thread.start()
+            try:
+                bench_encoding(count)
+                bench_socket(count)
+            finally:
+                compositor.stop.set()
+                thread.join()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+
+# Full frame throughput to the panel over a sweep of SPI clocks and chunk sizes, with the frames from
+# examples/framerate.py. Each clock also gets a row for the st7789 driver's own display(), which converts the image and
+# sends it as lists of 4096 ints, to compare the backend's writes against. Uses the backend from the display config, so
+# on the Pi this drives the real panel and elsewhere PIRATE_ALARM_DISPLAY=headless times a simulated bus.
+#
+#   ./benchSpi.py [seconds per run] [--clocks 40,62.5,80] [--chunks 4096,65536]
+
+from framebuffer import Framebuffer
+from PIL import Image, ImageDraw
+from rich import print
+import displayBackend
+import displayServer
+import math
+import sys
+import time
+
+CLOCKS_MHZ = [40, 62.5, 80, 90]
+FRAME_COUNT = 32
+
+
+def make_frames(width, height):
+    # A blue screen with a green quarter that swaps corners and a red dot sweeping across, as in framerate.py
+    images = []
+    for step in range(FRAME_COUNT):
+        image = Image.new("RGB", (width, height), (0, 0, 128))
+        draw = ImageDraw.Draw(image)
+        if step % 2 == 0:
+            draw.rectangle((width // 2, height // 2, width, height), (0, 128, 0))
+        else:
+            draw.rectangle((0, 0, width // 2 - 1, height // 2 - 1), (0, 128, 0))
+        x = int(math.sin(step / FRAME_COUNT * math.pi) * width)
+        draw.ellipse((x, 35, x + 10, 45), (255, 0, 0))
+        images.append(image)
+    return images
+
+
+def run(name, seconds, push, spi_speed_hz):
+    frame_bytes = displayServer.WIDTH * displayServer.HEIGHT * 2
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        push(count)
+        count += 1
+    elapsed = time.perf_counter() - start
+    fps = count / elapsed
+    # What the bus could carry with no gaps between bytes
+    ideal = spi_speed_hz / 8 / frame_bytes
+    print(
+        f"{name:<28} FPS: {fps:7.1f}    {fps * frame_bytes / 1e6:6.2f} MB/s    "
+        f"{fps / ideal * 100:5.1f}% of {ideal:5.1f} FPS at {spi_speed_hz / 1e6:g} MHz"
+    )
+
+
+def option(args, name, default):
+    if name in args:
+        return [float(value) for value in args[args.index(name) + 1].split(",")]
+    return default
+
+
+def main(args):
+    seconds = float(args[0]) if args and not args[0].startswith("--") else 3.0
+    clocks = option(args, "--clocks", CLOCKS_MHZ)
+    bufsiz = displayBackend.spidev_bufsiz()
+    chunks = [int(chunk) for chunk in option(args, "--chunks", [])]
+    if not chunks:
+        chunks = [1024 << shift for shift in range(7) if 1024 << shift <= bufsiz]
+
+    images = make_frames(displayServer.WIDTH, displayServer.HEIGHT)
+    framebuffers = []
+    for image in images:
+        framebuffer = Framebuffer(displayServer.WIDTH, displayServer.HEIGHT, displayServer.ROTATION)
+        framebuffer.update(image, displayServer.FULL_FRAME)
+        framebuffers.append(framebuffer)
+
+    with displayServer.open_display() as display:
+        print(f"spidev bufsiz: {bufsiz}    {display.capabilities}")
+        if not isinstance(display, displayBackend.PanelBackend):
+            print("[red]Only a panel backend has an SPI bus to sweep, try PIRATE_ALARM_DISPLAY=headless[/red]")
+            return
+        for mhz in clocks:
+            spi_speed_hz = int(mhz * 1e6)
+            display.set_spi_speed(spi_speed_hz)
+            run("driver display()", seconds, lambda i: display.screen.display(images[i % FRAME_COUNT]), spi_speed_hz)
+            for chunk_size in chunks:
+                try:
+                    display.chunk_size = displayBackend.spi_chunk_size(chunk_size, bufsiz)
+                except ValueError as error:
+                    print(f"Skipping: {error}, raise it with spidev.bufsiz={chunk_size} on the kernel command line")
+                    continue
+                push = lambda i: display.display_buffer(framebuffers[i % FRAME_COUNT], displayServer.FULL_FRAME)
+                run(f"backend, {chunk_size} byte chunks", seconds, push, spi_speed_hz)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
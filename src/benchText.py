@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+
+# Frames per second for a scrolling ticker and a clock, drawn the way examples/scrolling-text.py does it (clear the
+# screen, draw.text the whole string, convert the frame) against the compositor's text layer, which blits slices of
+# strips built from cached glyphs. Both skip the SPI transfer, so this is only the CPU cost per frame.
+
+from benchFramebuffer import NullDisplay, image_to_data, measure
+from PIL import Image, ImageDraw, ImageFont
+from rich import print
+import displayServer
+import sys
+import textLayer
+
+MESSAGE = "Hello World! How are you today?"
+SIZE = 30
+# Pixels per second, as in the example
+SPEED = 100
+FRAME_TIME = 1 / displayServer.MAX_FPS
+
+
+def clock_text(i):
+    # A new time every frame, which is far more often than a real clock changes
+    minute = i % (24 * 60)
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def main(frames):
+    width, height = displayServer.WIDTH, displayServer.HEIGHT
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype(textLayer.FONT, SIZE)
+    _, top, text_width, bottom = draw.textbbox((0, 0), MESSAGE, font=font)
+    text_y = (height - (bottom - top)) // 2
+
+    def example_scroll(i):
+        x = (i * FRAME_TIME * SPEED) % (text_width + width)
+        draw.rectangle((0, 0, width, height), (0, 0, 0))
+        draw.text((int(width - x), text_y), MESSAGE, font=font, fill=(255, 255, 255))
+        image_to_data(image, displayServer.ROTATION)
+
+    def example_clock(i):
+        draw.rectangle((0, 0, width, height), (0, 0, 0))
+        draw.text((60, text_y), clock_text(i), font=font, fill=(255, 255, 255))
+        image_to_data(image, displayServer.ROTATION)
+
+    compositor = displayServer.Compositor(NullDisplay())
+    compositor.render()
+    compositor.scroll_text("ticker", MESSAGE, text_y, SIZE, "white", SPEED)
+    start = compositor.text.items["ticker"].start
+
+    def layer_scroll(i):
+        compositor.advance_text(start + i * FRAME_TIME)
+        compositor.render()
+
+    measure("example scroller", frames, example_scroll)
+    measure("text layer scroller", frames, layer_scroll)
+    compositor.clear_text("ticker")
+    compositor.render()
+
+    def layer_clock(i):
+        compositor.draw_text("clock", clock_text(i), 60, text_y, SIZE, "white")
+        compositor.render()
+
+    measure("example clock", frames, example_clock)
+    measure("text layer clock", frames, layer_clock)
+    print(f"Text layer: {compositor.text.stats()}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+
+# Round trip latency of a REQ/REP echo over each zmq transport zmqNet can use, for message sizes ranging from a
+# binary draw_icon up to a full RGB565 frame. Run it on the Pi to see what the choice of transport is worth there.
+
+from rich import print
+from rich.table import Table
+import argparse
+import os
+import threading
+import time
+import zmq
+import zmqNet
+
+# A binary draw_icon, a typical JSON command, and a full 240x240 RGB565 frame
+SIZES = (16, 1024, 240 * 240 * 2)
+WARMUP = 10
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def echo(socket, count):
+    for _ in range(count):
+        socket.send_multipart(socket.recv_multipart(copy=False), copy=False)
+    socket.close()
+
+
+def measure(transport, size, count):
+    context = zmqNet.context()
+    server = context.socket(zmq.REP)
+    if transport == "ipc":
+        os.makedirs(zmqNet.IPC_DIR, exist_ok=True)
+    server.bind(zmqNet.bind_address("bench", transport))
+    thread = threading.Thread(target=echo, args=(server, WARMUP + count))
+    thread.start()
+
+    client = context.socket(zmq.REQ)
+    client.connect(zmqNet.connect_address("bench", transport))
+    payload = os.urandom(size)
+    # Let the connection come up before timing anything
+    for _ in range(WARMUP):
+        client.send(payload)
+        client.recv()
+
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        client.send(payload, copy=False)
+        client.recv(copy=False)
+        latencies.append(time.perf_counter() - start)
+
+    client.close()
+    thread.join()
+    latencies.sort()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Round trip latency for each zmq transport")
+    parser.add_argument("--count", type=int, default=2000, help="round trips per transport and size")
+    parser.add_argument("--transport", action="append", choices=zmqNet.TRANSPORTS, help="only these transports")
+    args = parser.parse_args()
+
+    table = Table(title=f"REQ/REP round trips, {args.count} each")
+    table.add_column("transport")
+    table.add_column("bytes", justify="right")
+    table.add_column("p50", justify="right")
+    table.add_column("p99", justify="right")
+    table.add_column("mean", justify="right")
+    for transport in args.transport or zmqNet.TRANSPORTS:
+        for size in SIZES:
+            latencies = measure(transport, size, args.count)
+            table.add_row(
+                transport,
+                str(size),
+                f"{percentile(latencies, 0.5) * 1e6:.0f} us",
+                f"{percentile(latencies, 0.99) * 1e6:.0f} us",
+                f"{sum(latencies) / len(latencies) * 1e6:.0f} us",
+            )
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import numpy
+
+# Every layer is kept as premultiplied RGBA uint8 (colour already scaled by alpha), so "src over dst" is one multiply
+# per channel: out = src + dst * (255 - src_alpha) / 255. Products of two bytes need 16 bits, which is what the
+# scratch buffers are for.
+
+
+def box_intersection(a, b):
+    box = (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+
+def box_difference(box, inside):
+    """The parts of box outside inside, which must lie within box, as up to four boxes."""
+    x0, y0, x1, y1 = box
+    ix0, iy0, ix1, iy1 = inside
+    parts = [(x0, y0, x1, iy0), (x0, iy1, x1, y1), (x0, iy0, ix0, iy1), (ix1, iy0, x1, iy1)]
+    return [part for part in parts if part[0] < part[2] and part[1] < part[3]]
+
+
+def region(array, box, origin=(0, 0)):
+    """The part of array covering an (x0, y0, x1, y1) screen box, for an array whose top left is at origin."""
+    x0, y0, x1, y1 = box
+    return array[y0 - origin[1] : y1 - origin[1], x0 - origin[0] : x1 - origin[0]]
+
+
+def alpha_box(pixels, origin=(0, 0)):
+    """The screen box around everything in an RGBA array that isn't fully transparent, or None if nothing is."""
+    alpha = pixels[..., 3]
+    rows = numpy.flatnonzero(alpha.any(axis=1))
+    if len(rows) == 0:
+        return None
+    columns = numpy.flatnonzero(alpha.any(axis=0))
+    x, y = origin
+    return (x + int(columns[0]), y + int(rows[0]), x + int(columns[-1]) + 1, y + int(rows[-1]) + 1)
+
+
+def premultiplied(rgba):
+    """A premultiplied copy of a straight alpha RGBA array, for the occasional image rather than every frame."""
+    out = numpy.empty(rgba.shape, dtype=numpy.uint8)
+    Blender(rgba.shape[1], rgba.shape[0]).premultiply(rgba, out)
+    return out
+
+
+class Blender:
+    """
+    Blending into caller provided arrays, with all the 16 bit intermediates in scratch buffers sized once for the
+    screen, so compositing a frame allocates nothing however many boxes and layers it takes. Every ufunc works on
+    contiguous scratch of one dtype: a cast or a broadcast inside a ufunc has numpy allocate a buffer for it.
+    """
+
+    def __init__(self, width, height):
+        self.wide = numpy.empty(height * width * 4, dtype=numpy.uint16)
+        self.carry = numpy.empty(height * width * 4, dtype=numpy.uint16)
+
+    def scratch(self, shape):
+        size = shape[0] * shape[1] * shape[2]
+        return self.wide[:size].reshape(shape), self.carry[:size].reshape(shape)
+
+    def divide(self, wide, carry):
+        # wide / 255 rounded to nearest, exact for any product of two bytes, without a division
+        wide += 128
+        numpy.right_shift(wide, 8, out=carry)
+        wide += carry
+        wide >>= 8
+
+    def over(self, src, below, out):
+        """Composite premultiplied src over below into out, all the same shape. out may be below."""
+        wide, carry = self.scratch(src.shape)
+        numpy.copyto(carry, src[..., 3:])
+        numpy.subtract(255, carry, out=carry)
+        numpy.copyto(wide, below)
+        wide *= carry
+        self.divide(wide, carry)
+        numpy.copyto(carry, src)
+        wide += carry
+        numpy.copyto(out, wide, casting="unsafe")
+
+    def premultiply(self, rgba, out):
+        """Premultiply a straight alpha RGBA array into out, which may be rgba itself."""
+        wide, carry = self.scratch(rgba.shape)
+        numpy.copyto(wide, rgba)
+        numpy.copyto(carry, rgba[..., 3:])
+        wide *= carry
+        self.divide(wide, carry)
+        wide[..., 3] = rgba[..., 3]
+        numpy.copyto(out, wide, casting="unsafe")
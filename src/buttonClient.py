@@ -1,5 +1,3 @@
-from rich import print
-from rich.logging import RichHandler
 import logging
 import zmq
 import zmqNet
@@ -9,9 +7,9 @@ logger = logging.getLogger(__name__)
 
 class ButtonClient:
     def __init__(self):
-        self.context = zmq.Context()
+        self.context = zmqNet.context()
         self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect(zmqNet.BUTTON_SUB)
+        zmqNet.connect(self.socket, "button")
         self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
 
     def get_button_event(self, blocking=True):
@@ -30,6 +28,8 @@ def log_button_events():
 
 
 if __name__ == "__main__":
+    from rich.logging import RichHandler
+
     logging.basicConfig(
         level=logging.DEBUG,
         handlers=[RichHandler(rich_tracebacks=True)],
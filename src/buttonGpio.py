@@ -2,9 +2,14 @@ from rich import print
 import datetime
 import gpiod
 import logging
+import metrics
+import select
+import wakeup
 
 logger = logging.getLogger(__name__)
 
+WAKEUPS = metrics.counter("button.wakeups")
+
 buttons = {
     "A": 5,
     "B": 6,
@@ -34,6 +39,7 @@ class ButtonEvents:
             buttons["X"]: callback_X,
             buttons["Y"]: callback_Y,
         }
+        self.stop = wakeup.WakeEvent()
 
     def __enter__(self):
         settings = gpiod.LineSettings(
@@ -55,12 +61,13 @@ class ButtonEvents:
 
     def run(self):
         logger.info("Waiting on gpio events...")
-        while True:
-            if self.lines.wait_edge_events():
+        while not self.stop.is_set():
+            readable, _, _ = select.select([self.lines.fd, self.stop], [], [])
+            WAKEUPS.inc()
+            if self.lines.fd in readable:
                 for event in self.lines.read_edge_events():
                     self.callbacks[event.line_offset]()
-            else:
-                logger.warning("wait_edge_events() returned False")
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.lines.__exit__(exc_type, exc_value, traceback)
+        self.stop.close()
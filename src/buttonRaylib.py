@@ -1,11 +1,15 @@
 from rich import print
 from rich.logging import RichHandler
 import logging
+import metrics
+import wakeup
 import zmq
 import zmqNet
 
 logger = logging.getLogger(__name__)
 
+WAKEUPS = metrics.counter("button.wakeups")
+
 
 class ButtonEvents:
     def __init__(self, callback_A, callback_B, callback_X, callback_Y):
@@ -13,16 +17,24 @@ class ButtonEvents:
         self.callback_B = callback_B
         self.callback_X = callback_X
         self.callback_Y = callback_Y
+        self.stop = wakeup.WakeEvent()
 
     def __enter__(self):
-        self.context = zmq.Context()
+        self.context = zmqNet.context()
         self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect(zmqNet.RAYLIB_SIM_BUTTON_SUB)
+        zmqNet.connect(self.socket, "raylib_button")
         self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
         return self
 
     def run(self):
-        while True:
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        poller.register(self.stop, zmq.POLLIN)
+        while not self.stop.is_set():
+            events = dict(poller.poll())
+            WAKEUPS.inc()
+            if self.socket not in events:
+                continue
             msg = self.socket.recv().decode()
             if msg == "A":
                 self.callback_A()
@@ -34,4 +46,5 @@ class ButtonEvents:
                 self.callback_Y()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.socket.disconnect(zmqNet.RAYLIB_SIM_BUTTON_SUB)
+        self.socket.close(linger=0)
+        self.stop.close()
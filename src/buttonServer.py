@@ -1,13 +1,17 @@
 from rich import print
 from rich.logging import RichHandler
 import logging
+import metrics
 import platform
+import signal
 import zmq
 import zmqNet
 import displayClient
 
 logger = logging.getLogger(__name__)
 
+PRESSES = metrics.counter("button.presses")
+
 # Import either the LCD screen or a raylib simulation of the screen
 machine = platform.machine()
 if machine == "x86_64" or machine == "AMD64":
@@ -18,45 +22,64 @@ else:
 
 class ButtonServer:
     def __init__(self):
-        self.context = zmq.Context()
+        self.context = zmqNet.context()
         self.socket = self.context.socket(zmq.PUB)
-        self.socket.bind(zmqNet.BUTTON_PUB)
+        zmqNet.bind(self.socket, "button")
         self.display = displayClient.DisplayClient()
         self.display.connect()
-
-    def run(self):
-        with ButtonEvents(
+        self.buttons = ButtonEvents(
             self.on_press_A,
             self.on_press_B,
             self.on_press_X,
             self.on_press_Y,
-        ) as buttons:
-            buttons.run()
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Frees the address for a restarted server
+        self.socket.close(linger=0)
+        self.display.close()
+
+    def run(self):
+        with self.buttons:
+            self.buttons.run()
+
+    def stop(self):
+        self.buttons.stop.set()
 
     def on_press_A(self):
         logger.info("A button pressed!")
+        PRESSES.inc()
         self.socket.send("A".encode("utf-8"))
         self.display.backlight()
 
     def on_press_B(self):
         logger.info("B button pressed!")
+        PRESSES.inc()
         self.socket.send("B".encode("utf-8"))
         self.display.backlight()
 
     def on_press_X(self):
         logger.info("X button pressed!")
+        PRESSES.inc()
         self.socket.send("X".encode("utf-8"))
         self.display.backlight()
 
     def on_press_Y(self):
         logger.info("Y button pressed!")
+        PRESSES.inc()
         self.socket.send("Y".encode("utf-8"))
         self.display.backlight()
 
 
 def main():
-    button_server = ButtonServer()
-    button_server.run()
+    metrics.serve("button")
+    with ButtonServer() as button_server:
+        # Wake the event loop to exit cleanly when systemd stops us
+        signal.signal(signal.SIGTERM, lambda signum, frame: button_server.stop())
+        button_server.run()
 
 
 if __name__ == "__main__":
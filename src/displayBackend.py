@@ -0,0 +1,330 @@
+# The panel the display server draws on, chosen by the "backend" in a JSON config file rather than by sniffing the
+# CPU architecture. The file is optional, every key has a default for the Pirate Audio board, e.g.
+#
+#   {"backend": "sim"}
+#   {"backend": "st7789", "spi_speed_hz": 62500000, "chunk_size": 65536}
+#
+# PIRATE_ALARM_DISPLAY overrides the backend without a file, which is how benchmarks pick "headless".
+
+import abc
+import backlight
+import json
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.environ.get("PIRATE_ALARM_DISPLAY_CONFIG", os.path.expanduser("~/.config/pirate-alarm/display.json"))
+DEFAULT_CONFIG = {
+    "backend": "st7789",
+    "port": 0,
+    # st7789.BG_SPI_CS_FRONT, without importing the driver on machines that don't have it
+    "cs": 1,
+    "dc": 9,
+    "backlight": 13,
+    "offset_left": 0,
+    "offset_top": 0,
+    "spi_speed_hz": 80 * 1000 * 1000,
+    # Bytes per SPI transfer, None for the largest the spidev driver takes in one go
+    "chunk_size": None,
+    # How the backlight is dimmed: "switch" is only on or off, "soft" toggles its pin from a thread, and "hardware"
+    # drives it from a PWM channel, see backlight.HardwarePwm
+    "backlight_pwm": "switch",
+    "pwm_chip": 0,
+    "pwm_channel": 1,
+    "pwm_hz": 1000,
+    # [hour, brightness] points, brightness from 0 to 1
+    "brightness_curve": backlight.DEFAULT_CURVE,
+    "fade_seconds": backlight.FADE_SECONDS,
+}
+
+# spidev refuses a transfer bigger than its bufsiz module parameter, which is 4096 unless raised on the kernel command
+# line with spidev.bufsiz=65536
+SPIDEV_BUFSIZ_PATH = "/sys/module/spidev/parameters/bufsiz"
+DEFAULT_SPIDEV_BUFSIZ = 4096
+
+
+def load_config(path=CONFIG_PATH):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path) as config_file:
+            overrides = json.load(config_file)
+        logger.debug(f"Display config from {path}: {overrides}")
+    except FileNotFoundError:
+        overrides = {}
+    unknown = overrides.keys() - config.keys()
+    if unknown:
+        raise ValueError(f"Unknown display config {sorted(unknown)} in {path}, expected some of {sorted(config)}")
+    config.update(overrides)
+    config["backend"] = os.environ.get("PIRATE_ALARM_DISPLAY", config["backend"])
+    if config["backend"] not in BACKENDS:
+        raise ValueError(f'Unknown display backend "{config["backend"]}", expected one of {sorted(BACKENDS)}')
+    if config["backlight_pwm"] not in ("switch", "soft", "hardware"):
+        raise ValueError(f'Unknown backlight_pwm "{config["backlight_pwm"]}", expected "switch", "soft" or "hardware"')
+    return config
+
+
+def spidev_bufsiz():
+    try:
+        with open(SPIDEV_BUFSIZ_PATH) as bufsiz:
+            return int(bufsiz.read())
+    except FileNotFoundError:
+        return DEFAULT_SPIDEV_BUFSIZ
+
+
+def spi_chunk_size(requested=None, bufsiz=None):
+    """
+    Bytes per transfer: the requested size, or the largest spidev takes, rounded down to whole pages so a long
+    window goes out as full page sized copies into the driver's buffer.
+    """
+    bufsiz = spidev_bufsiz() if bufsiz is None else bufsiz
+    limit = bufsiz if bufsiz < mmap.PAGESIZE else bufsiz - bufsiz % mmap.PAGESIZE
+    if requested is None:
+        return limit
+    if requested > bufsiz:
+        raise ValueError(f"SPI chunk of {requested} bytes is over spidev's bufsiz of {bufsiz}")
+    return requested
+
+
+class Capabilities:
+    def __init__(
+        self, pixel_formats=("rgb565",), region_writes=True, spi_speed_hz=None, chunk_size=None, dimmable=False
+    ):
+        # Framebuffer formats the backend sends as they are
+        self.pixel_formats = pixel_formats
+        # Whether a damaged box can be sent on its own, otherwise every update is a full frame
+        self.region_writes = region_writes
+        # None for backends with no SPI bus
+        self.spi_speed_hz = spi_speed_hz
+        self.chunk_size = chunk_size
+        # Whether set_brightness() dims, otherwise anything above zero is fully on
+        self.dimmable = dimmable
+
+    def __repr__(self):
+        return (
+            f"Capabilities({self.pixel_formats}, region_writes={self.region_writes},"
+            f" spi_speed_hz={self.spi_speed_hz}, chunk_size={self.chunk_size}, dimmable={self.dimmable})"
+        )
+
+
+class Backend(abc.ABC):
+    """
+    What the compositor draws through: a full frame from an image, a box of the packed framebuffer, and the
+    backlight, switched or dimmed to a PWM duty cycle. Only a backend with a window of its own can stop by itself.
+    """
+
+    capabilities = Capabilities()
+    # How the compositor drives the backlight, from the config
+    brightness_curve = backlight.Curve()
+    fade_seconds = backlight.FADE_SECONDS
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def stopped(self):
+        return False
+
+    def stop_events(self):
+        return []
+
+    @abc.abstractmethod
+    def display(self, image):
+        pass
+
+    @abc.abstractmethod
+    def display_buffer(self, framebuffer, box):
+        pass
+
+    @abc.abstractmethod
+    def set_backlight(self, enabled):
+        pass
+
+    def set_brightness(self, duty):
+        self.set_backlight(duty > 0)
+
+
+class PanelBackend(Backend):
+    """A screen with the st7789 driver's interface, fed the framebuffer one address window at a time."""
+
+    def __init__(self, screen, rotation, spi_speed_hz, chunk_size):
+        self.screen = screen
+        self.rotation = rotation
+        self.spi_speed_hz = spi_speed_hz
+        self.chunk_size = chunk_size
+
+    @property
+    def capabilities(self):
+        return Capabilities(spi_speed_hz=self.spi_speed_hz, chunk_size=self.chunk_size)
+
+    def set_spi_speed(self, spi_speed_hz):
+        self.spi_speed_hz = spi_speed_hz
+
+    def set_window(self, x0, y0, x1, y1):
+        self.screen.set_window(x0, y0, x1, y1)
+
+    def write(self, data):
+        for i in range(0, len(data), self.chunk_size):
+            self.screen.data(data[i : i + self.chunk_size])
+
+    def display(self, image):
+        self.set_window(0, 0, self.screen.width - 1, self.screen.height - 1)
+        self.write(self.screen.image_to_data(image, self.rotation))
+
+    def display_buffer(self, framebuffer, box):
+        # The framebuffer is already packed RGB565 in panel order, so this is just slicing and SPI writes
+        x0, y0, x1, y1 = framebuffer.panel_box(box)
+        self.set_window(x0, y0, x1 - 1, y1 - 1)
+        self.write(framebuffer.window(box))
+
+    def set_backlight(self, enabled):
+        logger.debug(f"{type(self).__name__}.set_backlight({enabled})")
+        self.screen.set_backlight(enabled)
+
+
+class St7789Backend(PanelBackend):
+    """
+    The Pirate Audio panel. The driver sets it up and owns the pins, but pixels skip its send(), which turns every
+    chunk into a list of ints for spidev.xfer. writebytes2 takes the framebuffer's memory as it is. That means using
+    the driver's _spi and _dc, which is why requirements.txt pins st7789 1.0 or later, the version they're from.
+    """
+
+    def __init__(self, width, height, rotation, config):
+        import st7789
+
+        # With hardware PWM the pin belongs to the PWM block, the driver taking it as a GPIO would undo that
+        hardware_pwm = config["backlight_pwm"] == "hardware"
+        screen = st7789.ST7789(
+            height=height,
+            width=width,
+            rotation=rotation,
+            port=config["port"],
+            cs=config["cs"],
+            dc=config["dc"],
+            backlight=None if hardware_pwm else config["backlight"],
+            spi_speed_hz=config["spi_speed_hz"],
+            offset_left=config["offset_left"],
+            offset_top=config["offset_top"],
+        )
+        super().__init__(screen, rotation, config["spi_speed_hz"], spi_chunk_size(config["chunk_size"]))
+        self.commands = st7789
+        self.offset_left = config["offset_left"]
+        self.offset_top = config["offset_top"]
+        if hardware_pwm:
+            self.pwm = backlight.HardwarePwm(config["pwm_chip"], config["pwm_channel"], config["pwm_hz"])
+        elif config["backlight_pwm"] == "soft":
+            self.pwm = backlight.SoftPwm(screen.set_backlight)
+        else:
+            self.pwm = None
+
+    @property
+    def capabilities(self):
+        return Capabilities(spi_speed_hz=self.spi_speed_hz, chunk_size=self.chunk_size, dimmable=self.pwm is not None)
+
+    def close(self):
+        if self.pwm is not None:
+            self.pwm.close()
+        self.screen._spi.close()
+
+    def set_spi_speed(self, spi_speed_hz):
+        self.screen._spi.max_speed_hz = spi_speed_hz
+        self.spi_speed_hz = spi_speed_hz
+
+    def set_window(self, x0, y0, x1, y1):
+        # Each coordinate pair as one transfer, where the driver sends a byte at a time
+        x0, x1 = x0 + self.offset_left, x1 + self.offset_left
+        y0, y1 = y0 + self.offset_top, y1 + self.offset_top
+        self.screen.command(self.commands.ST7789_CASET)
+        self.screen.data([x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF])
+        self.screen.command(self.commands.ST7789_RASET)
+        self.screen.data([y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF])
+        self.screen.command(self.commands.ST7789_RAMWR)
+
+    def write(self, data):
+        # DC stays high for the whole window
+        self.screen.set_pin(self.screen._dc, True)
+        spi = self.screen._spi
+        for i in range(0, len(data), self.chunk_size):
+            spi.writebytes2(data[i : i + self.chunk_size])
+
+    def set_backlight(self, enabled):
+        self.set_brightness(1.0 if enabled else 0.0)
+
+    def set_brightness(self, duty):
+        if self.pwm is None:
+            self.screen.set_backlight(duty > 0)
+        else:
+            self.pwm.set(duty)
+
+
+class HeadlessBackend(PanelBackend):
+    """An in-memory panel that takes as long as the SPI bus would, see screenHeadless."""
+
+    def __init__(self, width, height, rotation, config):
+        import screenHeadless
+
+        screen = screenHeadless.Screen(
+            height=height, width=width, rotation=rotation, spi_speed_hz=config["spi_speed_hz"]
+        )
+        # No spidev to ask, so the default chunk is what the driver would get on a stock kernel
+        chunk_size = config["chunk_size"] or DEFAULT_SPIDEV_BUFSIZ
+        super().__init__(screen, rotation, screen.spi_speed_hz, chunk_size)
+
+    def set_spi_speed(self, spi_speed_hz):
+        self.screen.spi_speed_hz = spi_speed_hz
+        self.spi_speed_hz = spi_speed_hz
+
+
+class SimBackend(Backend):
+    """A raylib window on a desktop, closing it stops the display server."""
+
+    capabilities = Capabilities(dimmable=True)
+
+    def __init__(self, width, height, rotation, config):
+        import screenSim
+
+        self.screen = screenSim.Screen(width=width, height=height, rotation=rotation)
+
+    def close(self):
+        self.screen.close()
+
+    def stopped(self):
+        return self.screen.stopped()
+
+    def stop_events(self):
+        return [self.screen.stop]
+
+    def display(self, image):
+        self.screen.display(image)
+
+    def display_buffer(self, framebuffer, box):
+        self.screen.display_buffer(framebuffer, box)
+
+    def set_backlight(self, enabled):
+        self.screen.set_backlight(enabled)
+
+    def set_brightness(self, duty):
+        self.screen.set_brightness(duty)
+
+
+BACKENDS = {
+    "headless": HeadlessBackend,
+    "sim": SimBackend,
+    "st7789": St7789Backend,
+}
+
+
+def open_backend(width, height, rotation, config=None):
+    config = load_config() if config is None else config
+    backend = BACKENDS[config["backend"]](width, height, rotation, config)
+    backend.brightness_curve = backlight.Curve(config["brightness_curve"])
+    # A backlight that's only on or off has nothing to fade through
+    backend.fade_seconds = config["fade_seconds"] if backend.capabilities.dimmable else 0
+    logger.info(f'Display backend "{config["backend"]}": {backend.capabilities}')
+    return backend
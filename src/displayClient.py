@@ -1,30 +1,97 @@
-from rich import print
+import contextlib
+import displayProtocol
 import json
+import metrics
 import sys
 import zmq
 import zmqNet
 
+ROUND_TRIP = metrics.histogram("display_client.round_trip")
+
 
 class DisplayClient:
-    def __init__(self):
-        self.context = zmq.Context()
+    def __init__(self, protocol=displayProtocol.BINARY):
+        self.context = zmqNet.context()
         self.socket = self.context.socket(zmq.REQ)
+        # The protocol we'd like, and the one the server agreed to once we've asked
+        self.preferred_protocol = protocol
+        self.protocol = None
+        self.pending = None
 
     def __enter__(self):
         self.connect()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        self.close()
+
+    def close(self):
+        self.socket.close(linger=0)
 
     def connect(self):
-        self.socket.connect(zmqNet.DISPLAY_SERVER_ADDR)
+        zmqNet.connect(self.socket, "display")
+
+    def negotiate(self):
+        # Ask lazily so that connecting never blocks on a display server that isn't up yet
+        protocols = [self.preferred_protocol, displayProtocol.JSON]
+        self.socket.send(str.encode(json.dumps({"command": "protocol", "protocols": protocols})))
+        response = json.loads(self.socket.recv().decode("utf-8"))
+        if response["response"] == "exception":
+            self.protocol = displayProtocol.LEGACY
+        else:
+            self.protocol = response["protocol"]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Queue every command sent inside the block and send them as one message with one reply."""
+        self.pending = []
+        try:
+            yield self
+            commands = self.pending
+        finally:
+            self.pending = None
+        if commands:
+            self.send_commands(commands)
 
     def send_command(self, command):
+        if self.pending is not None:
+            self.pending.append(command)
+            return None
+        return self.send_commands([command])[0]
+
+    def send_commands(self, commands):
+        if self.protocol is None:
+            self.negotiate()
+        with ROUND_TRIP.time():
+            return self.round_trip(commands)
+
+    def round_trip(self, commands):
+        if self.protocol == displayProtocol.BINARY:
+            frames = [displayProtocol.BINARY_MAGIC]
+            for command in commands:
+                frames.extend(displayProtocol.encode(command))
+            # Large pixel payloads go out without a copy, zmq still copies anything under its copy_threshold
+            self.socket.send_multipart(frames, copy=False)
+            return displayProtocol.decode_reply(self.socket.recv(), len(commands))
+
+        if self.protocol == displayProtocol.JSON:
+            self.socket.send_multipart([str.encode(json.dumps(c)) for c in commands])
+            return self.recv_json(len(commands))
+
+        return [self.send_json(command) for command in commands]
+
+    def send_json(self, command):
         self.socket.send(str.encode(json.dumps(command)))
+        return self.recv_json(1)[0]
+
+    def recv_json(self, count):
         response = json.loads(self.socket.recv().decode("utf-8"))
         if response["response"] == "exception":
             raise RuntimeError(response["name"], response["text"])
+        if count > 1:
+            return response["results"]
+        del response["response"]
+        return [response or None]
 
     def draw_icon(self, icon):
         return self.send_command({"command": "draw_icon", "icon": icon})
@@ -35,9 +102,69 @@ class DisplayClient:
     def icon_bar_color(self, red, green, blue, alpha):
         return self.send_command({"command": "icon_bar_color", "r": red, "g": green, "b": blue, "a": alpha})
 
+    def draw_frame(self, pixels, pixel_format="rgb"):
+        """Replace the background with raw pixels, "rgb" is 8 bits per channel and "rgb565" is big-endian 16 bit."""
+        if self.protocol is None:
+            self.negotiate()
+        # Pixels are a bytes frame, which JSON has no way to carry
+        if self.protocol != displayProtocol.BINARY:
+            raise RuntimeError(f'draw_frame needs the binary protocol, the display server agreed to "{self.protocol}"')
+        return self.send_command({"command": "draw_frame", "format": pixel_format, "pixels": pixels})
+
+    def play_animation(self, path, loops=0):
+        """Play a GIF or a directory of images as the background, loops=0 repeats until stopped."""
+        return self.send_command({"command": "play_animation", "path": path, "loops": loops})
+
+    def stop_animation(self):
+        return self.send_command({"command": "stop_animation"})
+
     def backlight(self):
         return self.send_command({"command": "backlight"})
 
+    def cache_stats(self):
+        return self.send_command({"command": "cache_stats"})
+
+    def warm_image(self, path):
+        """Decode an image into the server's cache ahead of a draw_image with the same path."""
+        return self.send_command({"command": "warm_image", "path": path})
+
+    def draw_text(self, name, text, x, y, size=30, color="white"):
+        """Show text with its top left at (x, y), replacing any earlier text with the same name."""
+        return self.send_command(
+            {"command": "draw_text", "name": name, "text": text, "x": x, "y": y, "size": size, "color": color}
+        )
+
+    def scroll_text(self, name, text, y, size=30, color="white", speed=100):
+        """Scroll text right to left across the screen at speed pixels per second, until cleared."""
+        return self.send_command(
+            {
+                "command": "scroll_text",
+                "name": name,
+                "text": text,
+                "y": y,
+                "size": size,
+                "color": color,
+                "speed": speed,
+            }
+        )
+
+    def clear_text(self, name):
+        return self.send_command({"command": "clear_text", "name": name})
+
+    def draw_overlay(self, path):
+        """Show a screen sized RGBA image over the background and under any text, icons and toasts."""
+        return self.send_command({"command": "draw_overlay", "path": path})
+
+    def clear_overlay(self):
+        return self.send_command({"command": "clear_overlay"})
+
+    def show_toast(self, text, seconds=3):
+        """Show a notification along the bottom of the screen, on top of everything, for a few seconds."""
+        return self.send_command({"command": "show_toast", "text": text, "seconds": seconds})
+
+    def warm_images(self, directory):
+        return self.send_command({"command": "warm_images", "directory": directory})
+
 
 if __name__ == "__main__":
     path = sys.argv[1]
@@ -0,0 +1,114 @@
+import json
+import struct
+
+# Protocols a DisplayClient can ask for, in order of preference
+BINARY = "binary"
+JSON = "json"
+# An old server that doesn't understand negotiation, one JSON command per round trip
+LEGACY = "legacy"
+
+# First frame of a binary multipart message, every following frame is one command.
+# A bytes field isn't packed into its command frame, it travels as the next frame so it can be sent without copying.
+BINARY_MAGIC = b"PAB1"
+
+REPLY_OK = 0
+REPLY_EXCEPTION = 1
+
+# Field names and types of each command, shared by the JSON schema check and the binary layout.
+# Opcodes are the position in this dict, so only ever append to it.
+COMMANDS = {
+    "backlight": {},
+    "cache_stats": {},
+    "clear_icon": {"icon": str},
+    "draw_icon": {"icon": str},
+    "draw_image": {"relative_path": str},
+    "icon_bar_color": {"r": int, "g": int, "b": int, "a": int},
+    "draw_frame": {"format": str, "pixels": bytes},
+    "warm_images": {"directory": str},
+    "play_animation": {"path": str, "loops": int},
+    "stop_animation": {},
+    "warm_image": {"path": str},
+    "draw_text": {"name": str, "text": str, "x": int, "y": int, "size": int, "color": str},
+    "scroll_text": {"name": str, "text": str, "y": int, "size": int, "color": str, "speed": int},
+    "clear_text": {"name": str},
+    "draw_overlay": {"path": str},
+    "clear_overlay": {},
+    "show_toast": {"text": str, "seconds": int},
+}
+
+OPCODES = {name: opcode for opcode, name in enumerate(COMMANDS)}
+NAMES = {opcode: name for name, opcode in OPCODES.items()}
+
+OPCODE = struct.Struct(">B")
+STR_LENGTH = struct.Struct(">H")
+INT = struct.Struct(">i")
+
+
+def encode(command):
+    """Return the frames for one command, the packed command itself followed by any bytes fields."""
+    name = command["command"]
+    parts = [OPCODE.pack(OPCODES[name])]
+    payloads = []
+    for field, field_type in COMMANDS[name].items():
+        value = command[field]
+        if field_type is bytes:
+            payloads.append(value)
+        elif field_type is str:
+            data = value.encode("utf-8")
+            parts.append(STR_LENGTH.pack(len(data)))
+            parts.append(data)
+        else:
+            parts.append(INT.pack(value))
+    return [b"".join(parts)] + payloads
+
+
+def decode(frame, frames):
+    """Decode one command frame, taking any bytes fields from the frames iterator."""
+    # The layout is fixed per opcode, so a frame that unpacks cleanly needs no further type checks
+    if not frame or frame[0] not in NAMES:
+        raise ValueError(f"Unknown opcode in frame: {bytes(frame[:1])}")
+    name = NAMES[frame[0]]
+    cmd = {"command": name}
+    offset = OPCODE.size
+    for field, field_type in COMMANDS[name].items():
+        if field_type is bytes:
+            payload = next(frames, None)
+            if payload is None:
+                raise ValueError(f'"{name}" is missing the frame for "{field}"')
+            cmd[field] = payload
+        elif field_type is str:
+            (length,) = STR_LENGTH.unpack_from(frame, offset)
+            offset += STR_LENGTH.size
+            cmd[field] = bytes(frame[offset : offset + length]).decode("utf-8")
+            offset += length
+        else:
+            (cmd[field],) = INT.unpack_from(frame, offset)
+            offset += INT.size
+    if offset != len(frame):
+        raise ValueError(f'"{name}" frame is {len(frame)} bytes, expected {offset}')
+    return cmd
+
+
+def encode_reply(results):
+    # The common case, a batch of commands that return nothing, is a single byte
+    if all(result is None for result in results):
+        return OPCODE.pack(REPLY_OK)
+    return OPCODE.pack(REPLY_OK) + json.dumps(results).encode("utf-8")
+
+
+def encode_exception(exception):
+    return OPCODE.pack(REPLY_EXCEPTION) + json.dumps(
+        {
+            "name": type(exception).__name__,
+            "text": str(exception),
+        }
+    ).encode("utf-8")
+
+
+def decode_reply(frame, count):
+    if frame[0] == REPLY_EXCEPTION:
+        response = json.loads(frame[1:])
+        raise RuntimeError(response["name"], response["text"])
+    if len(frame) == OPCODE.size:
+        return [None] * count
+    return json.loads(frame[1:])
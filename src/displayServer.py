@@ -1,71 +1,83 @@
-from PIL import Image, ImageColor
+from animation import Animation
+import blend
+from framebuffer import Framebuffer, unpack_rgb565
+from imageCache import ImageCache
+from layerStack import Layer, LayerStack
+from PIL import Image, ImageColor, ImageDraw
+from textLayer import TextLayer
 from rich import print
 from rich.logging import RichHandler
+import asyncio
+import backlight
+import collections
+import concurrent.futures
+import displayBackend
+import displayProtocol
 import json
 import logging
+import metrics
+import numpy
 import os
-import platform
+import procStats
+import sys
 import threading
 import time
+import wakeup
 import zmq
+import zmq.asyncio
 import zmqNet
 
-# Import either the LCD screen or a raylib simulation of the screen
-machine = platform.machine()
-if machine == "x86_64" or machine == "AMD64":
-    import screenSim
-
-    SCREEN_BACKEND = screenSim.Screen
-    SCREEN_CS = None
-    SCREEN_SIM = True
-else:
-    import st7789
-
-    SCREEN_BACKEND = st7789.ST7789
-    SCREEN_CS = st7789.BG_SPI_CS_FRONT
-    SCREEN_SIM = False
-
 logger = logging.getLogger(__name__)
 
+PARSE_TIME = metrics.histogram("display.parse")
+COMMAND_TIME = metrics.histogram("display.command")
+COMPOSE_TIME = metrics.histogram("display.compose")
+SPI_PUSH_TIME = metrics.histogram("display.spi_push")
+COMMANDS = metrics.counter("display.commands")
+FRAMES = metrics.counter("display.frames")
+SPI_BYTES = metrics.counter("display.spi_bytes")
+WAKEUPS = metrics.counter("display.wakeups")
+# Seconds from process start to the first frame, observed once, for supervisor.py --compare
+FIRST_FRAME = metrics.histogram("display.first_frame")
+
 # Display properties
 HEIGHT = 240
 WIDTH = 240
 ICON_BAR_HEIGHT = 48
 BACKLIGHT_TIMEOUT = 300
+# Upper bound on frames pushed to the panel, changes arriving faster than this are merged into one frame
+MAX_FPS = 30
+ROTATION = 90
 
+FULL_FRAME = (0, 0, WIDTH, HEIGHT)
+ICON_BAR_BOX = (0, 0, WIDTH, ICON_BAR_HEIGHT)
 
-class Display:
-    def __init__(self):
-        self.screen = SCREEN_BACKEND(
-            height=HEIGHT,
-            width=WIDTH,
-            rotation=90,
-            port=0,
-            cs=SCREEN_CS,
-            dc=9,
-            backlight=13,
-            spi_speed_hz=80 * 1000 * 1000,
-        )
+# Number of pre-composited icon bars to keep, one per (active icons, bar color) combination
+ICON_BAR_CACHE_SIZE = 16
 
-    def __enter__(self):
-        return self
+ICON_TYPES = {
+    "alarm": {"check", "none", "note", "off", "plus"},
+    "wifi": {"connected", "disconnected", "wait"},
+}
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        if SCREEN_SIM:
-            self.screen.close()
+# Notifications shown with show_toast, a rounded box along the bottom of the screen
+TOAST_TEXT_SIZE = 24
+TOAST_MARGIN = 8
+TOAST_PADDING = 6
+TOAST_COLOR = (0, 0, 0, 200)
 
-    def stopped(self):
-        if SCREEN_SIM:
-            return self.screen.stopped()
-        else:
-            return False
+# Once this much of the screen is damaged, one full frame is cheaper than several address windows.
+FULL_FRAME_DAMAGE_RATIO = 0.6
 
-    def display(self, image):
-        self.screen.display(image)
 
-    def set_backlight(self, enabled):
-        logger.debug(f"Display.set_backlight({enabled})")
-        self.screen.set_backlight(enabled)
+def box_area(box):
+    x0, y0, x1, y1 = box
+    return max(0, x1 - x0) * max(0, y1 - y0)
+
+
+def open_display(config=None):
+    """The backend named in the display config file, see displayBackend."""
+    return displayBackend.open_backend(WIDTH, HEIGHT, ROTATION, config)
 
 
 class Color:
@@ -83,25 +95,130 @@ class Color:
         return f"#{r:02x}{g:02x}{b:02x}{a:02x}"
 
 
+class IconAtlas:
+    """
+    Icons and finished bars as premultiplied arrays of only the ICON_BAR_HEIGHT rows the bar covers, with the bars
+    cached per (active icons, bar color).
+    """
+
+    def __init__(self, icon_types, blender):
+        self.blender = blender
+        # Decode every icon once up front, a missing file fails at startup rather than on the first draw
+        self.icons = dict()
+        self.boxes = dict()
+        for category, symbols in icon_types.items():
+            for symbol in symbols:
+                path = os.path.abspath(f"../images/icon_{category}_{symbol}.png")
+                with Image.open(path) as icon_image:
+                    icon = icon_image.convert("RGBA")
+                    if icon.size != (WIDTH, HEIGHT):
+                        raise ValueError(f"Icon {path} must be {WIDTH}x{HEIGHT} not {icon.width}x{icon.height}")
+                    box = icon.getbbox() or ICON_BAR_BOX
+                    if box[3] > ICON_BAR_HEIGHT:
+                        raise ValueError(f"Icon {path} reaches row {box[3]}, below the {ICON_BAR_HEIGHT} row icon bar")
+                    self.icons[(category, symbol)] = blend.premultiplied(numpy.asarray(icon)[:ICON_BAR_HEIGHT])
+                    self.boxes[(category, symbol)] = box
+
+        with Image.open(os.path.abspath("../images/icon_bar_mask.png")) as mask_image:
+            # Only the mask's coverage is used, it shapes the bar
+            self.mask = numpy.asarray(mask_image.convert("RGBA"))[:ICON_BAR_HEIGHT, :, 3].astype(numpy.uint32)
+
+        self.icon_bars = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def icon_box(self, category, symbol):
+        return self.boxes[(category, symbol)]
+
+    def icon_bar(self, active_icons, color):
+        key = (frozenset(active_icons.items()), str(color))
+        if key in self.icon_bars:
+            self.hits += 1
+            self.icon_bars.move_to_end(key)
+            return self.icon_bars[key]
+
+        self.misses += 1
+        r, g, b, a = ImageColor.getrgb(str(color))
+        icon_bar = numpy.empty((ICON_BAR_HEIGHT, WIDTH, 4), dtype=numpy.uint8)
+        alpha = (self.mask * a + 127) // 255
+        for channel, value in enumerate((r, g, b)):
+            icon_bar[..., channel] = (alpha * value + 127) // 255
+        icon_bar[..., 3] = alpha
+        for icon in active_icons.items():
+            self.blender.over(self.icons[icon], icon_bar, icon_bar)
+
+        self.icon_bars[key] = icon_bar
+        if len(self.icon_bars) > ICON_BAR_CACHE_SIZE:
+            self.icon_bars.popitem(last=False)
+        return icon_bar
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.icon_bars)}
+
+
 class Compositor:
-    def __init__(self, display):
+    def __init__(self, display, max_fps=MAX_FPS):
         self.display = display
-        self.backlight = threading.Event()
-        self.stop = threading.Event()
+        # These can all be waited on alongside each other and sockets, so idle threads block rather than poll
+        self.backlight = wakeup.WakeEvent()
+        # Brightness, fades and the idle timeout, driven by the backlight thread each time self.backlight is set
+        self.backlight_control = backlight.Backlight(
+            display.set_brightness, display.brightness_curve, BACKLIGHT_TIMEOUT, display.fade_seconds
+        )
+        # Once the backlight has faded out nothing is composited or pushed, until a command wakes it
+        self.dark = False
+        self.stop = wakeup.WakeEvent()
+        # Commands mutate state under the lock and set render_request, the render thread does the rest
+        self.lock = threading.Lock()
+        self.render_request = wakeup.WakeEvent()
+        self.frame_interval = 1.0 / max_fps
+        self.frames_rendered = 0
         self.active_icons = dict()
-        self.icon_bar_color = Color(86, 142, 215, 200)
-        self.icon_mask = Image.open(os.path.abspath("../images/icon_bar_mask.png"))
-        self.icon_bar = Image.new("RGBA", (WIDTH, HEIGHT))
-        self.background = Image.new("RGBA", (WIDTH, HEIGHT))
+        self.bar_color = Color(86, 142, 215, 200)
+        # Scratch space for every blend the compositor does, so a frame doesn't allocate
+        self.blender = blend.Blender(WIDTH, HEIGHT)
+        self.icon_atlas = IconAtlas(ICON_TYPES, self.blender)
+        # Always opaque, images with transparency are shown over black
+        self.background = numpy.zeros((HEIGHT, WIDTH, 4), dtype=numpy.uint8)
+        self.background[..., 3] = 255
+        self.image_cache = ImageCache(WIDTH, HEIGHT)
+        self.animation = None
+        self.text = TextLayer(WIDTH, HEIGHT, self.blender)
+        self.toast_box = None
+        self.toast_deadline = None
+        # Bottom to top. Only the background starts with content, the bar stays hidden until the first icon command.
+        self.layers = LayerStack(
+            WIDTH,
+            HEIGHT,
+            [
+                Layer("background", self.background, FULL_FRAME, empty=False),
+                Layer("overlay"),
+                Layer("text", self.text.pixels, FULL_FRAME),
+                Layer("icon_bar"),
+                Layer("toast"),
+            ],
+            self.blender,
+        )
+        self.add_damage(FULL_FRAME, "background")
+        # The packed copy of the top composite persists between redraws, only damaged boxes are rebuilt
+        self.framebuffer = Framebuffer(WIDTH, HEIGHT, ROTATION)
 
     def __enter__(self):
         self.thread = threading.Thread(target=self.thread_main)
         self.thread.start()
+        self.render_thread = threading.Thread(target=self.render_main)
+        self.render_thread.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.stop.set()
         self.thread.join()
+        self.render_thread.join()
+        self.close_events()
+
+    def close_events(self):
+        for event in (self.backlight, self.stop, self.render_request):
+            event.close()
 
     def stopped(self):
         if self.display.stopped() or self.stop.is_set():
@@ -110,6 +227,9 @@ class Compositor:
         else:
             return False
 
+    def stop_events(self):
+        return [self.stop] + self.display.stop_events()
+
     def thread_main(self):
         try:
             self.backlight_tread()
@@ -117,84 +237,343 @@ class Compositor:
             self.stop.set()
 
     def backlight_tread(self):
-        last_update_time = time.time()
-        backlight_status = True
+        # Sleeps until the next fade step or deadline, and indefinitely once the screen is dark
+        events = [self.backlight] + self.stop_events()
+        control = self.backlight_control
         while not self.stopped():
-            if self.backlight.wait(1.0):
-                if not backlight_status:
-                    self.display.set_backlight(True)
-                last_update_time = time.time()
-                backlight_status = True
+            wakeup.wait_any(events, control.timeout(time.monotonic()))
+            WAKEUPS.inc()
+            now = time.monotonic()
+            if self.backlight.is_set():
                 self.backlight.clear()
+                control.wake(now)
+            control.advance(now)
+            self.set_dark(control.dark())
+
+    def set_dark(self, dark):
+        if dark != self.dark:
+            logger.debug("Screen off, compositing stopped" if dark else "Screen on")
+            self.dark = dark
+            if not dark:
+                # The render loop may have gone to sleep with a ticker or animation running while it was dark
+                self.render_request.set()
+
+    def render_main(self):
+        try:
+            self.render_loop()
+        finally:
+            self.stop.set()
 
-            if backlight_status and time.time() - last_update_time >= BACKLIGHT_TIMEOUT:
-                self.display.set_backlight(False)
-                backlight_status = False
+    def render_loop(self):
+        events = [self.render_request] + self.stop_events()
+        next_frame = time.monotonic()
+        while not self.stopped():
+            animation = self.animation
+            timeout = self.frame_timeout(animation, next_frame - time.monotonic())
+            wakeup.wait_any(events, timeout)
+            WAKEUPS.inc()
+            if self.stopped():
+                break
+            if not self.render_request.is_set() and timeout is None:
+                continue
+
+            # Anything that arrives before the next tick lands in this frame rather than one of its own.
+            # A due animation frame isn't held back though, its timing comes from the animation.
+            now = time.monotonic()
+            if animation is None or animation.timeout(now) > 0:
+                delay = next_frame - now
+                if delay > 0 and self.stop.wait(delay):
+                    break
+
+            self.render_request.clear()
+            self.advance()
+            self.render()
+            next_frame = time.monotonic() + self.frame_interval
+
+    def frame_timeout(self, animation, frame_delay):
+        # Nothing moving or due to disappear means nothing to do until a command arrives. Nor does anything while the
+        # screen is dark, animations and tickers pick up from the right place when it wakes.
+        if self.dark:
+            return None
+        now = time.monotonic()
+        timeouts = []
+        if animation is not None:
+            timeouts.append(animation.timeout(now))
+        if self.text.scrolling():
+            # Tickers move every frame, at the frame rate cap
+            timeouts.append(max(0.0, frame_delay))
+        toast_deadline = self.toast_deadline
+        if toast_deadline is not None:
+            timeouts.append(max(0.0, toast_deadline - now))
+        return min(timeouts, default=None)
+
+    def advance(self):
+        # Everything that changes with time rather than on a command
+        self.advance_animation()
+        self.advance_text()
+        self.expire_toast()
+
+    def advance_text(self, now=None):
+        if not self.text.scrolling():
+            return
+        with self.lock:
+            for box in self.text.advance(time.monotonic() if now is None else now):
+                self.text.redraw(box)
+                self.add_damage(box, "text")
+
+    def advance_animation(self):
+        with self.lock:
+            if self.animation is None:
+                return
+            frame = self.animation.advance(time.monotonic())
+            if self.animation.finished():
+                logger.debug(f"Animation finished {self.animation.stats()}")
+                self.animation = None
+            elif frame is not None:
+                self.background[..., :3] = frame
+                self.add_damage(FULL_FRAME, "background")
+
+    def play_animation(self, path, loops):
+        # Decode every frame up front, outside the lock, so playback is only copies
+        animation = Animation(path, WIDTH, HEIGHT, loops)
+        with self.lock:
+            self.animation = animation
+        self.redraw()
+
+    def stop_animation(self):
+        with self.lock:
+            animation = self.animation
+            self.animation = None
+        return animation.stats() if animation else None
 
     def draw_icon(self, category, symbol):
-        self.active_icons[category] = symbol
-        self.redraw_icons()
+        with self.lock:
+            if self.active_icons.get(category) == symbol:
+                self.redraw()
+                return
+            if category in self.active_icons:
+                self.add_damage(self.icon_atlas.icon_box(category, self.active_icons[category]), "icon_bar")
+            self.active_icons[category] = symbol
+            self.add_damage(self.icon_atlas.icon_box(category, symbol), "icon_bar")
+            self.redraw_icons()
 
     def clear_icon(self, category, symbol):
-        del self.active_icons[category]
-        self.redraw_icons()
+        with self.lock:
+            self.add_damage(self.icon_atlas.icon_box(category, self.active_icons[category]), "icon_bar")
+            del self.active_icons[category]
+            self.redraw_icons()
 
     def icon_bar_color(self, r, g, b, a):
-        self.icon_bar_color.r = r
-        self.icon_bar_color.g = g
-        self.icon_bar_color.b = b
-        self.icon_bar_color.a = a
-        self.redraw_icons()
+        with self.lock:
+            self.bar_color.r = r
+            self.bar_color.g = g
+            self.bar_color.b = b
+            self.bar_color.a = a
+            self.add_damage(ICON_BAR_BOX, "icon_bar")
+            self.redraw_icons()
 
     def redraw_icons(self):
-        icon_bar_bg = Image.new("RGBA", (WIDTH, HEIGHT), str(self.icon_bar_color))
-        self.icon_bar = Image.new("RGBA", (WIDTH, HEIGHT))
-        self.icon_bar.paste(icon_bar_bg, mask=self.icon_mask)
-        for category, symbol in self.active_icons.items():
-            path = os.path.abspath(f"../images/icon_{category}_{symbol}.png")
-            with Image.open(path) as icon_image:
-                self.icon_bar.paste(icon_image, mask=icon_image)
+        layer = self.layers["icon_bar"]
+        if layer.empty:
+            layer.damage(ICON_BAR_BOX)
+            layer.empty = False
+        # Only the bar's rows, the layer stack copies everything under the rest of the screen straight through
+        layer.set_pixels(self.icon_atlas.icon_bar(self.active_icons, self.bar_color), ICON_BAR_BOX)
         self.redraw()
 
     def draw_image(self, image_path):
         logger.debug(f"Compositor.draw_image('{image_path}')")
-        with Image.open(image_path) as new_image:
-            if new_image.width != WIDTH or new_image.height != HEIGHT:
-                new_image = new_image.resize((WIDTH, HEIGHT))
-                logger.debug(f"Image resized from ({new_image.width},{new_image.height}) to ({WIDTH},{HEIGHT})")
-            self.background.paste(new_image)
+        # Cached images are already premultiplied RGBA at the screen size, so this is a straight copy
+        new_image = self.image_cache.load(image_path)
+        with self.lock:
+            self.animation = None
+            numpy.copyto(self.background, new_image)
+            self.background[..., 3] = 255
+            self.add_damage(FULL_FRAME, "background")
+        self.redraw()
+
+    def warm_image(self, image_path):
+        # Decoded now, on the command thread, so a later draw_image of the same path is a cache hit
+        self.image_cache.load(image_path)
+
+    def warm_images(self, directory):
+        # Decoding a whole directory takes seconds on a Pi, don't hold up the caller or the render thread
+        thread = threading.Thread(target=self.image_cache.warm, args=(directory,), daemon=True)
+        thread.start()
+
+    def draw_frame(self, pixels, pixel_format):
+        # numpy.frombuffer wraps the message buffer without a copy, copying into the background is the only copy made
+        if pixel_format == "rgb":
+            if len(pixels) != WIDTH * HEIGHT * 3:
+                raise ValueError(f"rgb frame must be {WIDTH * HEIGHT * 3} bytes not {len(pixels)}")
+            rgb = numpy.frombuffer(pixels, dtype=numpy.uint8).reshape((HEIGHT, WIDTH, 3))
+        elif pixel_format == "rgb565":
+            if len(pixels) != WIDTH * HEIGHT * 2:
+                raise ValueError(f"rgb565 frame must be {WIDTH * HEIGHT * 2} bytes not {len(pixels)}")
+            rgb565 = numpy.frombuffer(pixels, dtype=">u2").reshape((HEIGHT, WIDTH))
+            rgb = unpack_rgb565(rgb565)
+        else:
+            raise ValueError(f'Unknown pixel format "{pixel_format}", expected "rgb" or "rgb565"')
+
+        with self.lock:
+            self.animation = None
+            self.background[..., :3] = rgb
+            self.add_damage(FULL_FRAME, "background")
+        self.redraw()
+
+    def draw_text(self, name, text, x, y, size, color):
+        with self.lock:
+            self.update_text(self.text.draw_text(name, text, x, y, size, color))
+        self.redraw()
+
+    def scroll_text(self, name, text, y, size, color, speed):
+        with self.lock:
+            self.update_text(self.text.scroll_text(name, text, y, size, color, speed, time.monotonic()))
+        self.redraw()
+
+    def clear_text(self, name):
+        with self.lock:
+            self.update_text(self.text.clear_text(name))
+        self.redraw()
+
+    def update_text(self, damage):
+        for box in damage:
+            self.text.redraw(box)
+            self.add_damage(box, "text")
+        self.layers["text"].empty = not self.text.items
+
+    def draw_overlay(self, image_path):
+        # Cached like draw_image, the layer uses the cached array as it is
+        overlay = self.image_cache.load(image_path)
+        with self.lock:
+            layer = self.layers["overlay"]
+            self.clear_layer(layer)
+            layer.set_pixels(overlay, FULL_FRAME)
+            layer.empty = False
+            layer.damage(blend.alpha_box(overlay) or FULL_FRAME)
+        self.redraw()
+
+    def clear_overlay(self):
+        with self.lock:
+            self.clear_layer(self.layers["overlay"])
+        self.redraw()
+
+    def show_toast(self, text, seconds):
+        with self.lock:
+            # Shares the text layer's glyphs and strip cache
+            strip = self.text.strip(text, TOAST_TEXT_SIZE, "white")
+            strip_height, strip_width = strip.shape[:2]
+            width = min(WIDTH - 2 * TOAST_MARGIN, strip_width + 2 * TOAST_PADDING)
+            height = strip_height + 2 * TOAST_PADDING
+            x0 = (WIDTH - width) // 2
+            y0 = HEIGHT - TOAST_MARGIN - height
+            box = (x0, y0, x0 + width, y0 + height)
+            # Just the toast's own box, rounded_rectangle includes its end coordinates
+            background = Image.new("RGBA", (width, height))
+            ImageDraw.Draw(background).rounded_rectangle((0, 0, width - 1, height - 1), TOAST_PADDING, TOAST_COLOR)
+            toast = blend.premultiplied(numpy.asarray(background))
+            visible_width = min(strip_width, width - 2 * TOAST_PADDING)
+            target = toast[TOAST_PADDING : TOAST_PADDING + strip_height, TOAST_PADDING : TOAST_PADDING + visible_width]
+            self.blender.over(strip[:, :visible_width], target, target)
+
+            layer = self.layers["toast"]
+            self.clear_layer(layer)
+            layer.set_pixels(toast, box)
+            layer.empty = False
+            layer.damage(box)
+            self.toast_box = box
+            self.toast_deadline = time.monotonic() + seconds
         self.redraw()
 
+    def expire_toast(self):
+        with self.lock:
+            if self.toast_deadline is None or time.monotonic() < self.toast_deadline:
+                return
+            self.toast_deadline = None
+            self.clear_layer(self.layers["toast"], self.toast_box)
+
+    def clear_layer(self, layer, box=None):
+        if layer.empty:
+            return
+        layer.damage(box or blend.alpha_box(layer.pixels, layer.box[:2]) or layer.box)
+        layer.empty = True
+
+    def add_damage(self, box, layer):
+        self.layers[layer].damage(box)
+
     def redraw(self):
         self.backlight.set()
-        self.display.display(Image.alpha_composite(self.background, self.icon_bar))
+        self.render_request.set()
+
+    def render(self):
+        # Only the render thread writes the framebuffer, so the SPI push can happen outside the lock
+        with self.lock:
+            if not self.layers.dirty():
+                return
+            with COMPOSE_TIME.time():
+                frame, damage = self.layers.flatten()
+                if not self.display.capabilities.region_writes:
+                    damage = [FULL_FRAME]
+                elif sum(box_area(box) for box in damage) >= FULL_FRAME_DAMAGE_RATIO * box_area(FULL_FRAME):
+                    damage = [FULL_FRAME]
+                for box in damage:
+                    self.framebuffer.update(frame, box)
+
+        with SPI_PUSH_TIME.time():
+            for box in damage:
+                self.display.display_buffer(self.framebuffer, box)
+                SPI_BYTES.inc(box_area(box) * 2)
+        self.frames_rendered += 1
+        FRAMES.inc()
+        if self.frames_rendered == 1:
+            first_frame = procStats.process_age()
+            FIRST_FRAME.observe(first_frame)
+            logger.info(f"First frame {first_frame:.2f} s after process start")
 
 
 class Server:
+    context_class = zmq.Context
+    socket_type = zmq.REP
+
     def __init__(self, compositor):
         self.compositor = compositor
-        self.context = zmq.Context()
-        self.socket = self.context.socket(zmq.REP)
+        # A shadow of the shared context, so the asyncio server can reach inproc:// endpoints too
+        self.context = self.context_class.shadow(zmqNet.context().underlying)
+        self.socket = self.context.socket(self.socket_type)
 
+        commands = displayProtocol.COMMANDS
         self.commands_schema = {
-            "backlight": (self.cmd_backlight, {}),
-            "clear_icon": (self.cmd_clear_icon, {"icon": str}),
-            "draw_icon": (self.cmd_draw_icon, {"icon": str}),
-            "draw_image": (self.cmd_draw_image, {"relative_path": str}),
-            "icon_bar_color": (self.cmd_icon_bar_color, {"r": int, "g": int, "b": int, "a": int}),
-        }
-        self.icon_types = {
-            "alarm": {"check", "none", "note", "off", "plus"},
-            "wifi": {"connected", "disconnected", "wait"},
+            "backlight": (self.cmd_backlight, commands["backlight"]),
+            "cache_stats": (self.cmd_cache_stats, commands["cache_stats"]),
+            "clear_icon": (self.cmd_clear_icon, commands["clear_icon"]),
+            "clear_overlay": (self.cmd_clear_overlay, commands["clear_overlay"]),
+            "clear_text": (self.cmd_clear_text, commands["clear_text"]),
+            "draw_icon": (self.cmd_draw_icon, commands["draw_icon"]),
+            "draw_frame": (self.cmd_draw_frame, commands["draw_frame"]),
+            "draw_image": (self.cmd_draw_image, commands["draw_image"]),
+            "draw_overlay": (self.cmd_draw_overlay, commands["draw_overlay"]),
+            "draw_text": (self.cmd_draw_text, commands["draw_text"]),
+            "icon_bar_color": (self.cmd_icon_bar_color, commands["icon_bar_color"]),
+            "play_animation": (self.cmd_play_animation, commands["play_animation"]),
+            "scroll_text": (self.cmd_scroll_text, commands["scroll_text"]),
+            "show_toast": (self.cmd_show_toast, commands["show_toast"]),
+            "stop_animation": (self.cmd_stop_animation, commands["stop_animation"]),
+            "warm_image": (self.cmd_warm_image, commands["warm_image"]),
+            "warm_images": (self.cmd_warm_images, commands["warm_images"]),
+            # Only ever sent as JSON, since it's how the client finds out whether binary is understood
+            "protocol": (self.cmd_protocol, {"protocols": list}),
         }
+        self.protocols = [displayProtocol.BINARY, displayProtocol.JSON]
+        self.icon_types = ICON_TYPES
 
     def __enter__(self):
         logger.debug("Starting zmq display server.")
-        self.socket.bind(zmqNet.DISPLAY_CLIENT_FILTER)
+        zmqNet.bind(self.socket, "display")
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        # Frees the address for a restarted server
+        self.socket.close(linger=0)
 
     def parse(self, command):
         cmd = json.loads(command)
@@ -204,44 +583,74 @@ class Server:
             if field not in cmd:
                 raise ValueError(f'"{cmd["command"]}" does not contain required field: "{field}"')
             if not isinstance(cmd[field], expected_type):
-                raise ValueError(f'{cmd["command"]}["{field}"] must be "{type}" not "{type(cmd[field])}"')
+                raise ValueError(
+                    f'{cmd["command"]}["{field}"] must be "{expected_type.__name__}" not "{type(cmd[field])}"'
+                )
         return cmd
 
-    def respond_error(self, exception):
-        self.socket.send(
-            str.encode(
-                json.dumps(
-                    {
-                        "response": "exception",
-                        "name": type(exception).__name__,
-                        "text": str(exception),
-                    }
-                )
+    def reply_error(self, exception, binary=False):
+        if binary:
+            return displayProtocol.encode_exception(exception)
+        return str.encode(
+            json.dumps(
+                {
+                    "response": "exception",
+                    "name": type(exception).__name__,
+                    "text": str(exception),
+                }
             )
         )
 
-    def respond_ok(self):
-        self.socket.send(str.encode(json.dumps({"response": "ok"})))
+    def reply_ok(self, results, binary=False):
+        if binary:
+            return displayProtocol.encode_reply(results)
+        elif len(results) == 1:
+            return str.encode(json.dumps({"response": "ok", **(results[0] or {})}))
+        else:
+            return str.encode(json.dumps({"response": "ok", "results": results}))
 
     def stopped(self):
         return self.compositor.stopped()
 
     def run(self):
+        # Block until a request arrives or the compositor stops, there's nothing to do in between
+        poller = zmq.Poller()
+        poller.register(self.socket, zmq.POLLIN)
+        for event in self.compositor.stop_events():
+            poller.register(event, zmq.POLLIN)
         while not self.stopped():
-            if self.socket.poll(1000):
-                self.handle_message(self.socket.recv())
-
-    def handle_message(self, message):
-        logger.info(message)
+            events = dict(poller.poll())
+            WAKEUPS.inc()
+            if self.socket in events:
+                # Receive without copying so draw_frame pixels go straight from the zmq message to the compositor
+                frames = self.socket.recv_multipart(copy=False)
+                self.handle_message([frame.buffer for frame in frames])
+
+    def handle_message(self, frames):
+        self.socket.send(self.process_message(frames))
+
+    def process_message(self, frames):
+        # A message is either a binary batch behind the magic frame, or one or more JSON commands
+        binary = frames[0] == displayProtocol.BINARY_MAGIC
+        frames = iter(frames)
+        if binary:
+            next(frames)
+
+        results = []
         try:
-            cmd = self.parse(message)
-            command = cmd["command"]
-            self.commands_schema[command][0](cmd)
+            for frame in frames:
+                with PARSE_TIME.time():
+                    cmd = displayProtocol.decode(frame, frames) if binary else self.parse(bytes(frame))
+                logger.info(cmd)
+                command = cmd["command"]
+                with COMMAND_TIME.time():
+                    results.append(self.commands_schema[command][0](cmd))
+                COMMANDS.inc()
         except Exception as e:
             logger.exception("Server message handler")
-            self.respond_error(e)
+            return self.reply_error(e, binary)
         else:
-            self.respond_ok()
+            return self.reply_ok(results, binary)
 
     def cmd_draw_icon(self, cmd):
         category, symbol = cmd["icon"].split("_")
@@ -261,16 +670,212 @@ class Server:
             raise ValueError(f"Image file not found: {image}")
         self.compositor.draw_image(image)
 
+    def cmd_draw_overlay(self, cmd):
+        path = os.path.abspath(cmd["path"])
+        if not os.path.exists(path):
+            raise ValueError(f"Overlay image not found: {path}")
+        self.compositor.draw_overlay(path)
+
+    def cmd_clear_overlay(self, cmd):
+        self.compositor.clear_overlay()
+
+    def cmd_show_toast(self, cmd):
+        if cmd["seconds"] <= 0:
+            raise ValueError(f"show_toast seconds must be positive not {cmd['seconds']}")
+        self.compositor.show_toast(cmd["text"], cmd["seconds"])
+
+    def cmd_draw_frame(self, cmd):
+        self.compositor.draw_frame(cmd["pixels"], cmd["format"])
+
+    def cmd_play_animation(self, cmd):
+        path = os.path.abspath(cmd["path"])
+        if not os.path.exists(path):
+            raise ValueError(f"Animation not found: {path}")
+        self.compositor.play_animation(path, cmd["loops"])
+
+    def cmd_stop_animation(self, cmd):
+        return {"animation": self.compositor.stop_animation()}
+
+    def cmd_draw_text(self, cmd):
+        self.compositor.draw_text(cmd["name"], cmd["text"], cmd["x"], cmd["y"], cmd["size"], cmd["color"])
+
+    def cmd_scroll_text(self, cmd):
+        if cmd["speed"] <= 0:
+            raise ValueError(f"scroll_text speed must be positive not {cmd['speed']}")
+        self.compositor.scroll_text(cmd["name"], cmd["text"], cmd["y"], cmd["size"], cmd["color"], cmd["speed"])
+
+    def cmd_clear_text(self, cmd):
+        self.compositor.clear_text(cmd["name"])
+
     def cmd_icon_bar_color(self, cmd):
         self.compositor.icon_bar_color(cmd["r"], cmd["g"], cmd["b"], cmd["a"])
 
     def cmd_backlight(self, cmd):
         self.compositor.redraw()
 
+    def cmd_cache_stats(self, cmd):
+        return {
+            "icon_bar": self.compositor.icon_atlas.stats(),
+            "images": self.compositor.image_cache.stats(),
+            "text": self.compositor.text.stats(),
+        }
+
+    def cmd_warm_image(self, cmd):
+        image = os.path.abspath(cmd["path"])
+        if not os.path.exists(image):
+            raise ValueError(f"Image file not found: {image}")
+        self.compositor.warm_image(image)
+
+    def cmd_warm_images(self, cmd):
+        directory = os.path.abspath(cmd["directory"])
+        if not os.path.isdir(directory):
+            raise ValueError(f"Image directory not found: {directory}")
+        self.compositor.warm_images(directory)
+
+    def cmd_protocol(self, cmd):
+        for protocol in cmd["protocols"]:
+            if protocol in self.protocols:
+                return {"protocol": protocol}
+        raise ValueError(f"None of {cmd['protocols']} in {self.protocols}")
+
+
+class AsyncCompositor(Compositor):
+    """
+    Compositor for the asyncio server. Nothing polls: the backlight's next fade step or timeout is a timer handle that
+    each redraw reschedules, and rendering is a task that sleeps until there's a frame to push.
+    """
+
+    def __enter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.render_event = asyncio.Event()
+        self.backlight_timer = None
+        self.update_backlight()
+        # A single render thread keeps the framebuffer single-writer, same as the threaded compositor
+        self.render_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop.set()
+        if self.backlight_timer is not None:
+            self.backlight_timer.cancel()
+        self.render_executor.shutdown()
+        self.close_events()
+
+    def redraw(self):
+        # Commands run in executor threads, so hop onto the event loop
+        self.loop.call_soon_threadsafe(self.request_render)
+
+    def request_render(self):
+        self.backlight_control.wake(time.monotonic())
+        self.update_backlight()
+        self.render_event.set()
+
+    def update_backlight(self):
+        now = time.monotonic()
+        self.backlight_control.advance(now)
+        self.set_dark(self.backlight_control.dark())
+        if self.backlight_timer is not None:
+            self.backlight_timer.cancel()
+        timeout = self.backlight_control.timeout(now)
+        self.backlight_timer = None if timeout is None else self.loop.call_later(timeout, self.update_backlight)
+
+    def render_frame(self):
+        self.advance()
+        self.render()
+
+    async def run(self):
+        await asyncio.gather(self.render_loop(), self.watch_display())
+
+    async def watch_display(self):
+        events = self.display.stop_events()
+        if not events:
+            return
+        stopped = asyncio.Event()
+        for event in events:
+            self.loop.add_reader(event.fileno(), stopped.set)
+        try:
+            await stopped.wait()
+        finally:
+            for event in events:
+                self.loop.remove_reader(event.fileno())
+        self.stop.set()
+        self.render_event.set()
 
-def main():
-    with Display() as display:
+    async def render_loop(self):
+        next_frame = self.loop.time()
+        while not self.stopped():
+            animation = self.animation
+            timeout = self.frame_timeout(animation, next_frame - self.loop.time())
+            try:
+                await asyncio.wait_for(self.render_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            # Same coalescing as Compositor.render_loop, due animation frames aren't held back
+            if animation is None or animation.timeout(time.monotonic()) > 0:
+                delay = next_frame - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            self.render_event.clear()
+            await self.loop.run_in_executor(self.render_executor, self.render_frame)
+            next_frame = self.loop.time() + self.frame_interval
+
+
+class AsyncServer(Server):
+    """
+    Serves clients from a ROUTER socket on an asyncio loop. Each request runs in a worker thread, so a slow command
+    (decoding an image or an animation) doesn't hold up other clients the way REQ/REP lockstep does.
+    """
+
+    context_class = zmq.asyncio.Context
+    socket_type = zmq.ROUTER
+
+    async def run(self):
+        tasks = {
+            asyncio.create_task(self.compositor.run()),
+            asyncio.create_task(self.serve_forever()),
+        }
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+
+    async def serve_forever(self):
+        requests = set()
+        while not self.stopped():
+            # REQ clients arrive as [identity, empty delimiter, frames...]
+            frames = await self.socket.recv_multipart(copy=False)
+            request = asyncio.create_task(self.serve(frames[0].bytes, [frame.buffer for frame in frames[2:]]))
+            requests.add(request)
+            request.add_done_callback(requests.discard)
+
+    async def serve(self, identity, frames):
+        reply = await asyncio.get_running_loop().run_in_executor(None, self.process_message, frames)
+        await self.socket.send_multipart([identity, b"", reply])
+
+
+async def main_async(directories):
+    with open_display() as display:
+        with AsyncCompositor(display) as compositor:
+            for directory in directories:
+                compositor.warm_images(os.path.abspath(directory))
+            with AsyncServer(compositor) as server:
+                await server.run()
+
+
+def main(args):
+    # Any directories given on the command line are decoded into the image cache at startup
+    directories = [arg for arg in args if not arg.startswith("--")]
+    if "--asyncio" in args:
+        asyncio.run(main_async(directories))
+        return
+
+    with open_display() as display:
         with Compositor(display) as compositor:
+            for directory in directories:
+                compositor.warm_images(os.path.abspath(directory))
             with Server(compositor) as server:
                 server.run()
 
@@ -280,4 +885,5 @@ if __name__ == "__main__":
         level=logging.DEBUG,
         handlers=[RichHandler(rich_tracebacks=True)],
     )
-    main()
+    metrics.serve("display")
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+from PIL import Image
+import numpy
+
+
+def rotate_box(box, rotation, width, height):
+    """Map a (x0, y0, x1, y1) box in image coordinates to panel coordinates after numpy.rot90(rotation // 90)."""
+    x0, y0, x1, y1 = box
+    if rotation == 0:
+        return (x0, y0, x1, y1)
+    if rotation == 90:
+        return (y0, width - x1, y1, width - x0)
+    if rotation == 180:
+        return (width - x1, height - y1, width - x0, height - y0)
+    if rotation == 270:
+        return (height - y1, x0, height - y0, x1)
+    raise ValueError(f"Invalid rotation {rotation}")
+
+
+def unpack_rgb565(pixels):
+    """Expand an array of RGB565 values into an RGB888 array of the same shape plus a channel axis."""
+    pixels = pixels.astype(numpy.uint16)
+    rgb = numpy.empty(pixels.shape + (3,), dtype=numpy.uint8)
+    rgb[..., 0] = (pixels >> 8) & 0xF8
+    rgb[..., 1] = (pixels >> 3) & 0xFC
+    rgb[..., 2] = (pixels << 3) & 0xF8
+    return rgb
+
+
+class Framebuffer:
+    """
+    A persistent copy of the panel's RAM, stored the way the st7789 wants it on the wire:
+    rotated into panel order and packed as big-endian RGB565.
+    """
+
+    def __init__(self, width, height, rotation):
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        shape = (height, width) if rotation in (0, 180) else (width, height)
+
+        self.pixels = numpy.zeros(shape, dtype=">u2")
+        # Scratch space reused by every update, reshaped to the damaged box so the ufuncs see contiguous arrays and
+        # don't allocate buffers of their own
+        self.packed = numpy.empty(shape[0] * shape[1], dtype=numpy.uint16)
+        self.channel = numpy.empty(shape[0] * shape[1], dtype=numpy.uint16)
+        # Staging area for windows that aren't contiguous in self.pixels
+        self.window_buffer = numpy.empty(shape[0] * shape[1], dtype=">u2")
+
+    def panel_box(self, box):
+        return rotate_box(box, self.rotation, self.width, self.height)
+
+    def panel_slice(self, box):
+        x0, y0, x1, y1 = self.panel_box(box)
+        return (slice(y0, y1), slice(x0, x1))
+
+    def update(self, image, box):
+        """Pack the box of an RGB or RGBA image, or an array of either, into the framebuffer."""
+        if isinstance(image, numpy.ndarray):
+            # An opaque premultiplied composite is plain RGB, so arrays are packed in place without a copy
+            x0, y0, x1, y1 = box
+            pixels = image[y0:y1, x0:x1]
+        else:
+            pixels = numpy.asarray(image.crop(box))
+        rgb = numpy.rot90(pixels, self.rotation // 90)
+        rows, cols = rgb.shape[:2]
+        packed = self.packed[: rows * cols].reshape(rows, cols)
+        channel = self.channel[: rows * cols].reshape(rows, cols)
+
+        numpy.copyto(packed, rgb[..., 0])
+        packed &= 0xF8
+        packed <<= 8
+        numpy.copyto(channel, rgb[..., 1])
+        channel &= 0xFC
+        channel <<= 3
+        packed |= channel
+        numpy.copyto(channel, rgb[..., 2])
+        channel >>= 3
+        packed |= channel
+
+        # Assigning into the big-endian array does the byteswap in the same pass as the copy
+        self.pixels[self.panel_slice(box)] = packed
+
+    def window(self, box):
+        """Return the packed bytes for the panel address window covering box, without copying where possible."""
+        region = self.pixels[self.panel_slice(box)]
+        if not region.flags.c_contiguous:
+            staged = self.window_buffer[: region.size].reshape(region.shape)
+            staged[...] = region
+            region = staged
+        return memoryview(region).cast("B")
+
+    def image(self):
+        """Unpack the framebuffer back into an RGB image, as the panel would show it."""
+        pixels = numpy.rot90(self.pixels, -(self.rotation // 90))
+        return Image.fromarray(unpack_rgb565(pixels), "RGB")
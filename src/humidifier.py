@@ -5,6 +5,7 @@ import collections
 import getpass
 import json
 import logging
+import metrics
 import os
 import random
 import requests
@@ -13,6 +14,11 @@ import time
 
 logger = logging.getLogger(__name__)
 
+VESYNC_UPDATE_TIME = metrics.histogram("humidifier.vesync_update")
+VESYNC_COMMAND_TIME = metrics.histogram("humidifier.vesync_command")
+WEATHER_TIME = metrics.histogram("humidifier.weather_gov")
+WAKEUPS = metrics.counter("humidifier.wakeups")
+
 upper_limit = 55
 lower_limit = 40
 
@@ -31,6 +37,7 @@ class Humidifier:
 
     def run(self):
         while True:
+            WAKEUPS.inc()
             self.update()
             time.sleep(60 + (random.random() * 10 - 5))
 
@@ -44,14 +51,17 @@ class Humidifier:
         if hour >= 8 and hour < 21:
             if not display:
                 logger.info("Turning display on.")
-                self.hw.turn_on_display()
+                with VESYNC_COMMAND_TIME.time():
+                    self.hw.turn_on_display()
         else:
             if self.hw.is_on and display:
                 logger.info("Turning display off.")
-                self.hw.turn_off_display()
+                with VESYNC_COMMAND_TIME.time():
+                    self.hw.turn_off_display()
 
     def update(self):
-        self.hw.update()
+        with VESYNC_UPDATE_TIME.time():
+            self.hw.update()
 
         self.is_on = self.hw.is_on
 
@@ -72,19 +82,22 @@ class Humidifier:
         if self.hw.humidity < lower_limit and not self.is_on:
             if sys.stdout.isatty():
                 logger.info("Turning humidifier on.")
-            self.hw.set_mist_level(9)
-            self.hw.turn_on()
+            with VESYNC_COMMAND_TIME.time():
+                self.hw.set_mist_level(9)
+                self.hw.turn_on()
 
         if median > upper_limit and self.is_on:
             if sys.stdout.isatty():
                 logger.info("Turning humidifier off.")
-            self.hw.turn_off()
+            with VESYNC_COMMAND_TIME.time():
+                self.hw.turn_off()
 
         self.set_display()
 
     def log(self):
         try:
-            r = requests.get("https://api.weather.gov/stations/KDCA/observations/latest")
+            with WEATHER_TIME.time():
+                r = requests.get("https://api.weather.gov/stations/KDCA/observations/latest")
             kdca = json.loads(r.text)
             h = kdca["properties"]["relativeHumidity"]["value"]
             t = kdca["properties"]["temperature"]["value"] * 9.0 / 5.0 + 32
@@ -137,4 +150,5 @@ if __name__ == "__main__":
         level=logging.DEBUG,
         handlers=[RichHandler(rich_tracebacks=True)],
     )
+    metrics.serve("humidifier")
     main()
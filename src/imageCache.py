@@ -0,0 +1,101 @@
+from PIL import Image
+import blend
+import collections
+import logging
+import numpy
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Decoded backgrounds are width * height * 4 bytes each, 240x240 RGBA is 225 KiB
+IMAGE_CACHE_BUDGET = 32 * 1024 * 1024
+IMAGE_EXTENSIONS = (".bmp", ".gif", ".jpeg", ".jpg", ".png", ".webp")
+
+
+class ImageCache:
+    """
+    Least recently used cache of images decoded, resized and converted to premultiplied RGBA arrays, ready to copy
+    into a layer.
+    Entries are keyed by (path, mtime, file size) so an edited file is decoded again.
+    """
+
+    def __init__(self, width, height, budget=IMAGE_CACHE_BUDGET):
+        self.width = width
+        self.height = height
+        self.budget = budget
+        self.entry_size = width * height * 4
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, path):
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def decode(self, path):
+        with Image.open(path) as image:
+            if image.width != self.width or image.height != self.height:
+                logger.debug(f"Image resized from ({image.width},{image.height}) to ({self.width},{self.height})")
+                image = image.resize((self.width, self.height))
+            return blend.premultiplied(numpy.asarray(image.convert("RGBA")))
+
+    def load(self, path):
+        key = self.key(path)
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+
+        # Decode outside the lock so a warm up in the background doesn't stall draw_image
+        image = self.decode(path)
+        self.insert(key, image)
+        return image
+
+    def insert(self, key, image):
+        with self.lock:
+            self.entries[key] = image
+            self.entries.move_to_end(key)
+            while len(self.entries) * self.entry_size > self.budget and len(self.entries) > 1:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def full(self):
+        with self.lock:
+            return (len(self.entries) + 1) * self.entry_size > self.budget
+
+    def warm(self, directory):
+        """Decode every image in directory until the budget is full, returns how many were loaded."""
+        loaded = 0
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if self.full():
+                logger.info(f"Image cache budget full after warming {loaded} images from {directory}")
+                break
+            path = os.path.join(directory, name)
+            try:
+                key = self.key(path)
+                with self.lock:
+                    cached = key in self.entries
+                if not cached:
+                    self.insert(key, self.decode(path))
+                loaded += 1
+            except Exception:
+                logger.exception(f"Failed to warm {path}")
+        return loaded
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "bytes": len(self.entries) * self.entry_size,
+                "budget": self.budget,
+            }
@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+
+# A persisted index of the images in a directory, so picking an alarm image costs the same with ten photos as with ten
+# thousand. The directory is only listed again when its mtime changes or RESCAN_INTERVAL has passed, and then only
+# new or changed files are read.
+# Images come out in a shuffled order that doesn't repeat until every one has been shown, and each is served as a
+# copy already cropped to the screen size, so the display server never has to decode a full size photo.
+#
+#   ./imageIndex.py ~/images    update the index and show what the next pick would be
+
+import hashlib
+import logging
+import os
+import random
+import sqlite3
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = os.environ.get("PIRATE_ALARM_IMAGE_INDEX", os.path.expanduser("~/.cache/pirate-alarm/images"))
+WIDTH = 240
+HEIGHT = 240
+# Seconds between listings even when the directory's mtime hasn't changed, which is the only way to notice a file
+# that was rewritten in place
+RESCAN_INTERVAL = 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    rank REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_by_rank ON images (rank);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+def name_digest(name):
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+
+class ImageIndex:
+    """
+    The shuffle is a random rank per image and a cursor: the next image is the lowest rank above the cursor, and
+    running off the end deals new ranks. Images added part way through get a rank in what's left of the current pass.
+    """
+
+    def __init__(self, directory, index_dir=INDEX_DIR, width=WIDTH, height=HEIGHT):
+        self.directory = os.path.abspath(directory)
+        self.width = width
+        self.height = height
+        self.cache_dir = os.path.join(index_dir, name_digest(self.directory)[:16])
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, "index.sqlite"))
+        self.db.executescript(SCHEMA)
+        self.random = random.Random()
+
+    def close(self):
+        self.db.close()
+
+    def get_state(self, key, default=None):
+        row = self.db.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_state(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def thumbnail_path(self, name, mtime_ns):
+        return os.path.join(self.cache_dir, f"{name_digest(name)}-{mtime_ns}.png")
+
+    def remove_thumbnail(self, name, mtime_ns):
+        try:
+            os.unlink(self.thumbnail_path(name, mtime_ns))
+        except FileNotFoundError:
+            pass
+
+    def update(self, force=False):
+        """Bring the index up to date with the directory, returns whether it had to be listed."""
+        directory_mtime = os.stat(self.directory).st_mtime_ns
+        now = time.time()
+        if (
+            not force
+            and self.get_state("directory_mtime_ns") == directory_mtime
+            and now - self.get_state("scanned_at", 0.0) < RESCAN_INTERVAL
+        ):
+            return False
+
+        # PIL (which imageCache imports too) is only needed for new images, the common case of an unchanged
+        # directory never loads it
+        from imageCache import IMAGE_EXTENSIONS
+        from PIL import Image
+
+        start = time.perf_counter()
+        rows = self.db.execute("SELECT name, mtime_ns, size FROM images")
+        indexed = {name: (mtime_ns, size) for name, mtime_ns, size in rows}
+        cursor = self.get_state("cursor", 0.0)
+        seen = set()
+        added = 0
+        with self.db:
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                seen.add(entry.name)
+                if indexed.get(entry.name) == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                try:
+                    # Only reads the header
+                    with Image.open(entry.path) as image:
+                        width, height = image.size
+                except Exception:
+                    logger.warning(f"Skipping {entry.path}, not a readable image")
+                    continue
+                if entry.name in indexed:
+                    self.remove_thumbnail(entry.name, indexed[entry.name][0])
+                self.db.execute(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry.name, stat.st_mtime_ns, stat.st_size, width, height, self.random.uniform(cursor, 1.0)),
+                )
+                added += 1
+
+            removed = indexed.keys() - seen
+            for name in removed:
+                self.remove_thumbnail(name, indexed[name][0])
+            self.db.executemany("DELETE FROM images WHERE name = ?", [(name,) for name in removed])
+            self.set_state("directory_mtime_ns", directory_mtime)
+            self.set_state("scanned_at", now)
+        logger.info(
+            f"Indexed {self.directory}: {added} new or changed, {len(removed)} removed,"
+            f" {len(seen)} in total in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        return True
+
+    def shuffle(self):
+        names = [name for (name,) in self.db.execute("SELECT name FROM images")]
+        ranks = [self.random.random() for _ in names]
+        # Don't start the new pass with the image that ended the last one
+        last = self.get_state("last")
+        if last in names and len(names) > 1:
+            first = ranks.index(min(ranks))
+            if names[first] == last:
+                ranks[first] = self.random.uniform(0.5, 1.0)
+        self.db.executemany("UPDATE images SET rank = ? WHERE name = ?", zip(ranks, names))
+        self.set_state("cursor", 0.0)
+
+    def peek(self):
+        """The next (name, mtime_ns, rank) in the shuffle, dealing a new pass when this one is used up."""
+        query = "SELECT name, mtime_ns, rank FROM images WHERE rank > ? ORDER BY rank LIMIT 1"
+        row = self.db.execute(query, (self.get_state("cursor", 0.0),)).fetchone()
+        if row is None:
+            with self.db:
+                self.shuffle()
+            row = self.db.execute(query, (0.0,)).fetchone()
+        return row
+
+    def choose(self):
+        """Path of a screen sized copy of the next image in the shuffle."""
+        self.update()
+        while True:
+            row = self.peek()
+            if row is None:
+                raise FileNotFoundError(f"No images in {self.directory}")
+            name, mtime_ns, rank = row
+            with self.db:
+                self.set_state("cursor", rank)
+                self.set_state("last", name)
+            try:
+                return self.thumbnail(name, mtime_ns)
+            except Exception:
+                logger.exception(f"Dropping {name} from the index")
+                with self.db:
+                    self.db.execute("DELETE FROM images WHERE name = ?", (name,))
+
+    def prepare_next(self):
+        """Make the next image's copy now, while nothing is waiting on it."""
+        row = self.peek()
+        if row is not None:
+            self.thumbnail(row[0], row[1])
+
+    def thumbnail(self, name, mtime_ns):
+        path = self.thumbnail_path(name, mtime_ns)
+        if os.path.exists(path):
+            return path
+
+        from PIL import Image, ImageOps
+
+        with Image.open(os.path.join(self.directory, name)) as image:
+            # For a JPEG this decodes at a fraction of the size, which is most of the work saved on a big photo
+            image.draft("RGB", (self.width, self.height))
+            image = ImageOps.exif_transpose(image)
+            image = ImageOps.fit(image.convert("RGBA"), (self.width, self.height))
+        # Written to the side and renamed into place, so a half written copy is never served
+        partial = f"{path}.{os.getpid()}.partial"
+        image.save(partial, "PNG", compress_level=1)
+        os.rename(partial, path)
+        return path
+
+
+def main(args):
+    index = ImageIndex(args[0])
+    start = time.perf_counter()
+    index.update(force="--rescan" in args)
+    updated = time.perf_counter()
+    count = index.db.execute("SELECT count(*) FROM images").fetchone()[0]
+    print(f"{count} images, index updated in {(updated - start) * 1000:.1f} ms")
+    row = index.peek()
+    if row is not None:
+        print(f"Next up: {row[0]}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
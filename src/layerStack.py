@@ -0,0 +1,82 @@
+from blend import box_difference, box_intersection, region
+import numpy
+
+
+class Layer:
+    def __init__(self, name, pixels=None, box=None, empty=True):
+        self.name = name
+        # Premultiplied RGBA covering box, owners may write into it or swap in another array along with its box
+        self.pixels = pixels
+        self.box = box
+        # An empty layer is skipped entirely, it costs nothing however many changes happen below it
+        self.empty = empty
+        # Boxes where this layer's own content has changed since the last flatten
+        self.dirty = []
+        # Whether flat holds this layer composited over everything beneath it, it's kept between frames
+        self.built = False
+        self.flat = None
+
+    def damage(self, box):
+        if box not in self.dirty:
+            self.dirty.append(box)
+
+    def set_pixels(self, pixels, box):
+        self.pixels = pixels
+        self.box = box
+
+
+class LayerStack:
+    """
+    Layers from the bottom up, each with a cached composite of itself and everything below. A change is re-blended
+    from the layer it happened in upwards, only inside the boxes that changed, and only where the layer has pixels,
+    the rest of a box is copied from below. The bottom layer must cover the whole screen and be opaque.
+    """
+
+    def __init__(self, width, height, layers, blender):
+        self.width = width
+        self.height = height
+        self.layers = layers
+        self.by_name = {layer.name: layer for layer in layers}
+        self.blender = blender
+        # Composites are allocated once, the bottom layer is its own composite
+        for layer in layers[1:]:
+            layer.flat = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def dirty(self):
+        return any(layer.dirty for layer in self.layers)
+
+    def flatten(self):
+        """Bring every cached composite up to date, returns the top one and the boxes that changed on screen."""
+        full = (0, 0, self.width, self.height)
+        damage = []
+        below = None
+        for layer in self.layers:
+            for box in layer.dirty:
+                if box not in damage:
+                    damage.append(box)
+            layer.dirty = []
+            if layer.empty:
+                layer.built = False
+                continue
+
+            if below is None:
+                below = layer.pixels
+                continue
+            # The first frame with content: outside the damage it hasn't changed on screen, but it was never built
+            for box in (damage if layer.built else [full]):
+                self.compose(layer, below, box)
+            layer.built = True
+            below = layer.flat
+        return below, damage
+
+    def compose(self, layer, below, box):
+        inside = box_intersection(box, layer.box)
+        outside = box_difference(box, inside) if inside else [box]
+        for part in outside:
+            numpy.copyto(region(layer.flat, part), region(below, part))
+        if inside:
+            src = region(layer.pixels, inside, layer.box[:2])
+            self.blender.over(src, region(below, inside), region(layer.flat, inside))
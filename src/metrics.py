@@ -0,0 +1,148 @@
+import bisect
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import zmq
+import zmqNet
+
+logger = logging.getLogger(__name__)
+
+# Metrics are off unless PIRATE_ALARM_METRICS=1, in which case every daemon also serves them on its stats endpoint.
+# When off, every metric is a shared null object so instrumented code pays one method call and nothing else.
+ENABLED = os.environ.get("PIRATE_ALARM_METRICS") == "1"
+
+# Histogram bucket upper bounds in seconds, from 100us up to 10s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = dict()
+
+
+class Counter:
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return {"type": "counter", "value": self.value}
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    """Counts of observations in fixed buckets. Updates aren't locked, so a racing observe can very rarely be lost."""
+
+    def __init__(self, name, buckets=BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        # One extra bucket for anything above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def time(self):
+        return Timer(self)
+
+    def snapshot(self):
+        return {
+            "type": "histogram",
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class NullCounter:
+    def inc(self, amount=1):
+        pass
+
+
+class NullHistogram:
+    timer = contextlib.nullcontext()
+
+    def observe(self, seconds):
+        pass
+
+    def time(self):
+        return self.timer
+
+
+NULL_COUNTER = NullCounter()
+NULL_HISTOGRAM = NullHistogram()
+
+
+def counter(name):
+    if not ENABLED:
+        return NULL_COUNTER
+    return registry.setdefault(name, Counter(name))
+
+
+def histogram(name):
+    if not ENABLED:
+        return NULL_HISTOGRAM
+    return registry.setdefault(name, Histogram(name))
+
+
+def snapshot():
+    metrics = {name: metric.snapshot() for name, metric in sorted(registry.items())}
+    # CPU time used by the whole process, so a power report can turn two snapshots into a CPU percentage
+    metrics["process.cpu_seconds"] = {"type": "counter", "value": time.process_time()}
+    return metrics
+
+
+def percentile(metric, fraction):
+    """Estimate a percentile of a histogram snapshot as the upper bound of the bucket it falls in."""
+    if metric["count"] == 0:
+        return None
+    target = metric["count"] * fraction
+    seen = 0
+    for bound, count in zip(metric["buckets"] + [float("inf")], metric["counts"]):
+        seen += count
+        if seen >= target:
+            return bound
+    return float("inf")
+
+
+class StatsServer:
+    def __init__(self, service):
+        self.endpoint = zmqNet.stats_endpoint(service)
+        self.context = zmqNet.context()
+        self.thread = threading.Thread(target=self.thread_main, daemon=True)
+
+    def thread_main(self):
+        socket = self.context.socket(zmq.REP)
+        zmqNet.bind(socket, self.endpoint)
+        logger.debug(f"Serving metrics on {self.endpoint}")
+        while True:
+            socket.recv()
+            socket.send(json.dumps(snapshot()).encode("utf-8"))
+
+
+def serve(service):
+    """Answer every request on service's stats endpoint with a JSON snapshot of this process's metrics, if enabled."""
+    if not ENABLED:
+        return None
+    server = StatsServer(service)
+    server.thread.start()
+    return server
@@ -0,0 +1,41 @@
+import os
+
+# Linux only, everything here comes from /proc
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def process_age(pid="self"):
+    """Seconds since the process started, interpreter startup and imports included."""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name can contain spaces, the fields after it can't
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open("/proc/uptime") as f:
+        uptime = float(f.read().split()[0])
+    # starttime is field 22, the 20th after the command name and state
+    return uptime - int(fields[19]) / CLOCK_TICKS
+
+
+def rss_kib(pid="self"):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def find_processes(scripts):
+    """Map each running python process started as one of scripts (e.g. displayServer.py) to its pid."""
+    found = dict()
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                argv = f.read().decode(errors="replace").split("\0")
+        except OSError:
+            continue
+        for arg in argv[1:3]:
+            if os.path.basename(arg) in scripts:
+                found[int(pid)] = os.path.basename(arg)
+    return found
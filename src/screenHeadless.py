@@ -0,0 +1,124 @@
+from framebuffer import unpack_rgb565
+from PIL import Image
+import collections
+import logging
+import numpy
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# How many pushed windows to remember, each one is a timestamped record rather than the pixels themselves
+FRAME_HISTORY = 1024
+
+
+class Frame:
+    def __init__(self, start, end, window, size):
+        self.start = start
+        self.end = end
+        self.window = window
+        self.size = size
+
+    def __repr__(self):
+        return f"Frame({self.start:.6f}, {self.end:.6f}, {self.window}, {self.size})"
+
+
+class Screen:
+    """
+    Stands in for st7789.ST7789 on a machine with no panel and no window. Pixel writes land in an in-memory copy of
+    the panel RAM and take as long as they would on an SPI bus of the configured speed, so the rest of the display
+    pipeline, chunking included, runs exactly as it does on the Pi. The bus speed can be overridden with the
+    PIRATE_ALARM_SPI_HZ environment variable.
+    """
+
+    def __init__(self, height, width, rotation, spi_speed_hz, **kwargs):
+        logger.debug(f"Screen.__init__({kwargs})")
+        self._width = width
+        self._height = height
+        self._rotation = rotation
+        self.spi_speed_hz = int(os.environ.get("PIRATE_ALARM_SPI_HZ", spi_speed_hz))
+        self.ram = numpy.zeros((height, width), dtype=">u2")
+        self.backlight = True
+
+        self.frames = collections.deque(maxlen=FRAME_HISTORY)
+        self.frames_pushed = 0
+        self.bytes_sent = 0
+        self.busy_until = 0.0
+        self.window = None
+        self.window_data = bytearray()
+        self.window_start = None
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def height(self):
+        return self._height
+
+    def transfer(self, size):
+        # Schedule against when the bus frees up rather than sleeping per call, so sleep overshoot doesn't accumulate
+        now = time.perf_counter()
+        self.busy_until = max(now, self.busy_until) + size * 8 / self.spi_speed_hz
+        delay = self.busy_until - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.bytes_sent += size
+
+    def command(self, data):
+        self.transfer(1)
+
+    def data(self, data):
+        self.transfer(len(data))
+        if self.window is None:
+            return
+
+        self.window_data += data
+        x0, y0, x1, y1 = self.window
+        rows, cols = y1 - y0 + 1, x1 - x0 + 1
+        if len(self.window_data) >= rows * cols * 2:
+            pixels = numpy.frombuffer(self.window_data, dtype=">u2", count=rows * cols)
+            self.ram[y0 : y1 + 1, x0 : x1 + 1] = pixels.reshape((rows, cols))
+            self.frames.append(Frame(self.window_start, time.perf_counter(), self.window, rows * cols * 2))
+            self.frames_pushed += 1
+            self.window = None
+            self.window_data = bytearray()
+
+    def set_window(self, x0=0, y0=0, x1=None, y1=None):
+        if x1 is None:
+            x1 = self._width - 1
+        if y1 is None:
+            y1 = self._height - 1
+        # CASET and RASET with four data bytes each, then RAMWR
+        self.transfer(11)
+        self.window = (x0, y0, x1, y1)
+        self.window_data = bytearray()
+        self.window_start = time.perf_counter()
+
+    def display(self, image):
+        self.set_window()
+        pixelbytes = self.image_to_data(image, self._rotation)
+        for i in range(0, len(pixelbytes), 4096):
+            self.data(pixelbytes[i : i + 4096])
+
+    def image_to_data(self, image, rotation=0):
+        # Same conversion as st7789.ST7789.image_to_data()
+        if not isinstance(image, numpy.ndarray):
+            image = numpy.array(image.convert("RGB"))
+        pb = numpy.rot90(image, rotation // 90).astype("uint16")
+        red = (pb[..., [0]] & 0xF8) << 8
+        green = (pb[..., [1]] & 0xFC) << 3
+        blue = (pb[..., [2]] & 0xF8) >> 3
+        return (red | green | blue).byteswap().tobytes()
+
+    def set_backlight(self, value):
+        logger.debug(f"Screen.set_backlight({value})")
+        self.backlight = value
+
+    def image(self):
+        """The panel contents as an RGB image, the right way up."""
+        pixels = numpy.rot90(self.ram, -(self._rotation // 90))
+        return Image.fromarray(unpack_rgb565(pixels), "RGB")
+
+    def frame_timestamps(self):
+        return [frame.end for frame in self.frames]
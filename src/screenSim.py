@@ -1,9 +1,12 @@
+from framebuffer import unpack_rgb565
+from raylib import ffi
 from rich import print
 import logging
-import os
+import numpy
 import PIL
 import pyray as rl
 import threading
+import wakeup
 import zmq
 import zmqNet
 
@@ -13,39 +16,49 @@ logger = logging.getLogger(__name__)
 class Screen:
     def __init__(self, **kwargs):
         logger.debug(f"Screen.__init__({kwargs})")
-        self.screen_update_path = os.path.abspath("./screen-update.png")
-        if os.path.exists(self.screen_update_path):
-            try:
-                os.remove(self.screen_update_path)
-            except:
-                pass
+        # Frames are handed to the raylib thread through this buffer, which is uploaded straight into the screen texture
+        self.width = kwargs["width"]
+        self.height = kwargs["height"]
+        self.pixels = numpy.zeros((self.height, self.width, 4), dtype=numpy.uint8)
+        self.pixels[..., 3] = 255
+        self.lock = threading.Lock()
         self.update = threading.Event()
-        self.update_done = threading.Event()
-        self.stop = threading.Event()
+        self.stop = wakeup.WakeEvent()
         self.backlight = threading.Event()
+        # PWM duty cycle of the backlight, the screen is drawn tinted by it
+        self.brightness = 1.0
 
         self.backlight.set()
         self.thread = threading.Thread(target=self.thread_main)
         self.thread.start()
 
-        self.zmq_context = zmq.Context()
+        self.zmq_context = zmqNet.context()
         self.zmq_socket = self.zmq_context.socket(zmq.PUB)
-        self.zmq_socket.bind(zmqNet.RAYLIB_SIM_BUTTON_PUB)
+        zmqNet.bind(self.zmq_socket, "raylib_button")
 
     def close(self):
         self.stop.set()
         self.thread.join()
+        self.zmq_socket.close(linger=0)
+        self.stop.close()
 
     def stopped(self):
         return self.stop.is_set()
 
     def display(self, image):
         assert isinstance(image, PIL.Image.Image)
-        image.save(self.screen_update_path, format="png")
-        self.update_done.clear()
+        rgba = numpy.asarray(image.convert("RGBA"))
+        with self.lock:
+            self.pixels[...] = rgba
+        self.update.set()
+
+    def display_buffer(self, framebuffer, box):
+        # Undo the panel rotation and RGB565 packing for just the damaged box
+        x0, y0, x1, y1 = box
+        region = numpy.rot90(framebuffer.pixels[framebuffer.panel_slice(box)], -(framebuffer.rotation // 90))
+        with self.lock:
+            self.pixels[y0:y1, x0:x1, :3] = unpack_rgb565(region)
         self.update.set()
-        if not self.update_done.wait(1):
-            self.stop.set()
 
     def set_backlight(self, enabled):
         logger.debug(f"Screen.set_backlight({enabled})")
@@ -53,7 +66,13 @@ class Screen:
             self.backlight.set()
         else:
             self.backlight.clear()
-        self.update.set()
+
+    def set_brightness(self, duty):
+        self.brightness = duty
+        if duty > 0:
+            self.backlight.set()
+        else:
+            self.backlight.clear()
 
     def thread_main(self):
         try:
@@ -100,17 +119,20 @@ class Screen:
         rl.clear_background(rl.BLANK)
 
         window_image = rl.gen_image_color(700, 343, rl.BLANK)
-        screen_image = rl.gen_image_color(240, 240, rl.BLACK)
-
-        screen_rect = rl.Rectangle(0, 0, 240, 240)
         window_rect = rl.Rectangle(0, 0, 700, 343)
-        window_screen_rect = rl.Rectangle(331, 29, 240, 240)
+        window_screen_rect = rl.Rectangle(331, 29, self.width, self.height)
 
         background = rl.load_image("../images/Pirate_Audio_DAC.png")
         rl.image_draw(window_image, background, window_rect, window_rect, rl.WHITE)
         window_texture = rl.load_texture_from_image(window_image)
+        rl.unload_image(background)
+        rl.unload_image(window_image)
+
+        # The window texture never changes, only this one is updated when a frame arrives
+        screen_image = rl.gen_image_color(self.width, self.height, rl.BLACK)
+        screen_texture = rl.load_texture_from_image(screen_image)
+        rl.unload_image(screen_image)
 
-        backlight_status = self.backlight.is_set()
         click = None
         while not self.stop.is_set() and not rl.window_should_close():
             if rl.is_mouse_button_pressed(rl.MOUSE_BUTTON_LEFT):
@@ -120,28 +142,27 @@ class Screen:
             elif click:
                 click = None
 
-            # Update the screen if we have a new frame to display
+            # Upload the new frame if we have one
             if self.update.is_set():
-                if os.path.exists(self.screen_update_path):
-                    update_image = rl.load_image(self.screen_update_path)
-                    rl.image_draw(screen_image, update_image, screen_rect, screen_rect, rl.WHITE)
-
-                # Either draw the screen, or a black square if the backlight is off
-                if self.backlight.is_set():
-                    rl.image_draw(window_image, screen_image, screen_rect, window_screen_rect, rl.WHITE)
-                else:
-                    rl.image_draw_rectangle_rec(window_image, window_screen_rect, rl.BLACK)
-
-                rl.unload_texture(window_texture)
-                window_texture = rl.load_texture_from_image(window_image)
-                self.update.clear()
-                self.update_done.set()
+                with self.lock:
+                    self.update.clear()
+                    rl.update_texture(screen_texture, ffi.from_buffer(self.pixels))
 
             rl.begin_drawing()
+            rl.clear_background(rl.BLANK)
             rl.draw_texture(window_texture, 0, 0, rl.WHITE)
+            # Either draw the screen, or a black square if the backlight is off
+            if self.backlight.is_set():
+                level = int(255 * self.brightness)
+                tint = rl.Color(level, level, level, 255)
+                rl.draw_texture(screen_texture, int(window_screen_rect.x), int(window_screen_rect.y), tint)
+            else:
+                rl.draw_rectangle_rec(window_screen_rect, rl.BLACK)
             if click:
                 rl.draw_rectangle_rec(click, rl.Color(26, 28, 32, 255))
             rl.end_drawing()
 
+        rl.unload_texture(screen_texture)
+        rl.unload_texture(window_texture)
         rl.close_window()
         self.stop.set()
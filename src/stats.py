@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+
+from rich import print
+from rich.table import Table
+import argparse
+import json
+import metrics
+import time
+import zmq
+import zmqNet
+
+
+def fetch(context, service, timeout_ms):
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    zmqNet.connect(socket, zmqNet.stats_endpoint(service))
+    try:
+        socket.send(b"stats")
+        return json.loads(socket.recv())
+    except zmq.error.Again:
+        return None
+    finally:
+        socket.close()
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float("inf"):
+        return "inf"
+    return f"{seconds * 1000:.2f} ms"
+
+
+def show(service, snapshot):
+    table = Table(title=service)
+    table.add_column("metric")
+    table.add_column("count", justify="right")
+    table.add_column("mean", justify="right")
+    table.add_column("p50 <=", justify="right")
+    table.add_column("p99 <=", justify="right")
+    for name, metric in snapshot.items():
+        if metric["type"] == "counter":
+            table.add_row(name, str(metric["value"]), "", "", "")
+        else:
+            mean = metric["sum"] / metric["count"] if metric["count"] else None
+            table.add_row(
+                name,
+                str(metric["count"]),
+                format_seconds(mean),
+                format_seconds(metrics.percentile(metric, 0.5)),
+                format_seconds(metrics.percentile(metric, 0.99)),
+            )
+    print(table)
+
+
+def power_report(snapshots, later, seconds):
+    # Everything idle should be asleep in a blocking wait, so wakeups per minute and CPU should both sit near zero
+    table = Table(title=f"power over {seconds:g} s")
+    table.add_column("service")
+    table.add_column("wakeups/min", justify="right")
+    table.add_column("cpu", justify="right")
+    for service, snapshot in snapshots.items():
+        if snapshot is None or later.get(service) is None:
+            table.add_row(service, "-", "-")
+            continue
+        wakeups = sum(
+            later[service][name]["value"] - metric["value"]
+            for name, metric in snapshot.items()
+            if name.endswith(".wakeups") and name in later[service]
+        )
+        cpu = later[service]["process.cpu_seconds"]["value"] - snapshot["process.cpu_seconds"]["value"]
+        table.add_row(service, f"{wakeups * 60 / seconds:.1f}", f"{cpu / seconds * 100:.2f}%")
+    print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show metrics from the running daemons")
+    parser.add_argument("services", nargs="*", help=f"any of {', '.join(zmqNet.STATS_SERVICES)}, default: all")
+    parser.add_argument("--json", action="store_true", help="print raw JSON snapshots")
+    parser.add_argument("--timeout", type=int, default=500, help="milliseconds to wait for each daemon")
+    parser.add_argument("--power", type=float, metavar="SECONDS", help="report wakeups and CPU use over SECONDS")
+    args = parser.parse_args()
+    for service in args.services:
+        if service not in zmqNet.STATS_SERVICES:
+            parser.error(f"unknown service {service}")
+
+    context = zmq.Context()
+    snapshots = dict()
+    for service in args.services or zmqNet.STATS_SERVICES:
+        snapshots[service] = fetch(context, service, args.timeout)
+
+    if args.power:
+        time.sleep(args.power)
+        later = {service: fetch(context, service, args.timeout) for service in snapshots}
+        power_report(snapshots, later, args.power)
+        return
+
+    if args.json:
+        print(json.dumps(snapshots, indent=2))
+        return
+
+    for service, snapshot in snapshots.items():
+        if snapshot is None:
+            print(f"[yellow]{service}: no answer (not running, or started without PIRATE_ALARM_METRICS=1)[/yellow]")
+        else:
+            show(service, snapshot)
+
+
+if __name__ == "__main__":
+    main()
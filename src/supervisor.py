@@ -0,0 +1,275 @@
+#! /usr/bin/env python
+
+# Runs the display, button, wifi and humidifier services as threads of one process, instead of a systemd unit and a
+# Python interpreter each. They talk over inproc:// through a shared zmq context, and the usual endpoints stay bound
+# for anything outside the process (alarm.py). Each service is imported inside its own thread and restarted on its own
+# when it crashes, so a broken one can't take the others down with it.
+#
+# Threads rather than one asyncio loop on purpose: every service is a blocking loop (REQ/REP, gpiod's select, wifi
+# pings, pyvesync's requests), and moving them onto a loop would mean rewriting all four. The saving asked for is the
+# single interpreter and its imports, which threads get just as well, and the GIL costs nothing while they block.
+#
+#   ./supervisor.py                       run every service
+#   ./supervisor.py display button        run only these
+#   ./supervisor.py --report              RSS of whichever layout is running, supervised or one unit per service
+#   ./supervisor.py --compare [services]  start each layout in turn and compare boot to first frame and RSS
+#
+# --compare starts its own copies of the services on the usual endpoints, so stop the running ones first. Off the Pi,
+# PIRATE_ALARM_DISPLAY=headless stands in for the panel.
+
+from rich import print
+from rich.logging import RichHandler
+from rich.table import Table
+import displayClient
+import logging
+import metrics
+import os
+import procStats
+import signal
+import stats
+import subprocess
+import sys
+import threading
+import time
+import wakeup
+import zmq
+import zmqNet
+
+logger = logging.getLogger(__name__)
+
+RESTARTS = metrics.counter("supervisor.restarts")
+
+# Seconds before the first restart, doubling while a service keeps crashing straight away
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+# A service that ran at least this long before crashing is restarted after RESTART_DELAY again
+STABLE_TIME = 60.0
+# Seconds to wait for services to shut down cleanly on exit
+STOP_TIMEOUT = 5.0
+# Seconds after startup to log memory use, by when every service should have finished importing and connecting
+RSS_REPORT_DELAY = 30.0
+# --compare gives a layout this long to get its first frame out, then this long more before reading its RSS
+FIRST_FRAME_TIMEOUT = 60.0
+COMPARE_SETTLE = 5.0
+
+SERVICE_SCRIPTS = {
+    "display": "displayServer.py",
+    "button": "buttonServer.py",
+    "wifi": "wifiMonitor.py",
+    "humidifier": "humidifier.py",
+}
+SCRIPTS = ("supervisor.py",) + tuple(SERVICE_SCRIPTS.values())
+
+
+def display_service(service, directories):
+    import displayServer
+
+    with displayServer.open_display() as display:
+        with displayServer.Compositor(display) as compositor:
+            service.on_stop = compositor.stop.set
+            for directory in directories:
+                compositor.warm_images(os.path.abspath(directory))
+            with displayServer.Server(compositor) as server:
+                server.run()
+
+
+def button_service(service, directories):
+    import buttonServer
+
+    with buttonServer.ButtonServer() as server:
+        service.on_stop = server.stop
+        server.run()
+
+
+def wifi_service(service, directories):
+    import wifiMonitor
+
+    monitor = wifiMonitor.WifiMonitor()
+    try:
+        monitor.run()
+    finally:
+        monitor.display.close()
+
+
+def humidifier_service(service, directories):
+    import humidifier
+
+    humidifier.main()
+
+
+SERVICES = {
+    "display": display_service,
+    "button": button_service,
+    "wifi": wifi_service,
+    "humidifier": humidifier_service,
+}
+
+
+class Service:
+    def __init__(self, name, target, directories):
+        self.name = name
+        self.target = target
+        self.directories = directories
+        self.stopping = threading.Event()
+        # Set by the running service to ask it to return, services without one are daemon threads that die with us
+        self.on_stop = None
+        self.restarts = 0
+        self.thread = threading.Thread(target=self.supervise, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def supervise(self):
+        delay = RESTART_DELAY
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            try:
+                self.target(self, self.directories)
+                logger.warning(f"{self.name} exited")
+            except Exception:
+                logger.exception(f"{self.name} crashed")
+            self.on_stop = None
+            if self.stopping.is_set():
+                break
+
+            if time.monotonic() - started >= STABLE_TIME:
+                delay = RESTART_DELAY
+            logger.info(f"Restarting {self.name} in {delay:.0f} s")
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, MAX_RESTART_DELAY)
+            self.restarts += 1
+            RESTARTS.inc()
+
+    def stop(self):
+        self.stopping.set()
+        if self.on_stop is not None:
+            self.on_stop()
+
+
+def report():
+    processes = procStats.find_processes(SCRIPTS)
+    if not processes:
+        print("[yellow]No pirate-alarm services running[/yellow]")
+        return
+    table = Table(title="pirate-alarm processes")
+    table.add_column("pid", justify="right")
+    table.add_column("script")
+    table.add_column("RSS", justify="right")
+    table.add_column("up", justify="right")
+    total = 0
+    for pid, script in sorted(processes.items(), key=lambda item: item[1]):
+        rss = procStats.rss_kib(pid)
+        total += rss
+        table.add_row(str(pid), script, f"{rss / 1024:.1f} MiB", f"{procStats.process_age(pid):.0f} s")
+    table.add_row("", "total", f"{total / 1024:.1f} MiB", "")
+    print(table)
+
+
+def first_frame(stats_service, processes):
+    """
+    Seconds from process start to the display's first frame, from its metrics, or None if it never came. The display
+    server only draws once it's asked to, so this sends the first command, as the wifi monitor does at boot.
+    """
+    with displayClient.DisplayClient() as display:
+        display.socket.setsockopt(zmq.RCVTIMEO, int(FIRST_FRAME_TIMEOUT * 1000))
+        try:
+            display.backlight()
+        except zmq.error.Again:
+            return None
+    context = zmqNet.context()
+    deadline = time.monotonic() + FIRST_FRAME_TIMEOUT
+    while time.monotonic() < deadline and all(process.poll() is None for process in processes):
+        snapshot = stats.fetch(context, stats_service, 500)
+        if snapshot is not None and snapshot.get("display.first_frame", {}).get("count"):
+            return snapshot["display.first_frame"]["sum"]
+        time.sleep(0.1)
+    return None
+
+
+def measure_layout(commands, stats_service, env):
+    """Start a layout, returns (seconds to first frame, total RSS in KiB) once it has settled."""
+    processes = [
+        subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for command in commands
+    ]
+    try:
+        seconds = first_frame(stats_service, processes)
+        time.sleep(COMPARE_SETTLE)
+        rss = sum(procStats.rss_kib(process.pid) for process in processes if process.poll() is None)
+        return seconds, rss
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def compare(names):
+    """Boot to first frame and RSS with one process per service, as the systemd units run them, against supervised."""
+    python = sys.executable
+    layouts = {
+        "one unit per service": ([[python, SERVICE_SCRIPTS[name]] for name in names], "display"),
+        "supervisor": ([[python, "supervisor.py", *names]], "supervisor"),
+    }
+    table = Table(title=f"{', '.join(names)}")
+    table.add_column("layout")
+    table.add_column("processes", justify="right")
+    table.add_column("first frame", justify="right")
+    table.add_column("RSS", justify="right")
+    for layout, (commands, stats_service) in layouts.items():
+        seconds, rss = measure_layout(commands, stats_service, dict(os.environ, PIRATE_ALARM_METRICS="1"))
+        first = "-" if seconds is None else f"{seconds:.2f} s"
+        table.add_row(layout, str(len(commands)), first, f"{rss / 1024:.1f} MiB")
+    print(table)
+
+
+def main(args):
+    if "--report" in args:
+        report()
+        return
+    if "--compare" in args:
+        names = [arg for arg in args if arg in SERVICES] or list(SERVICES)
+        if "display" not in names:
+            raise SystemExit("--compare times the display's first frame, so it needs the display service")
+        compare(names)
+        return
+
+    names = [arg for arg in args if not arg.startswith("--") and arg in SERVICES] or list(SERVICES)
+    # Anything else on the command line is an image directory for the display server, as with displayServer.py
+    directories = [arg for arg in args if not arg.startswith("--") and arg not in SERVICES]
+
+    zmqNet.use_inproc()
+    metrics.serve("supervisor")
+
+    stop = wakeup.WakeEvent()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    services = [Service(name, SERVICES[name], directories) for name in names]
+    for service in services:
+        service.start()
+    logger.info(f"Supervising {', '.join(names)}")
+
+    if not wakeup.wait_any([stop], RSS_REPORT_DELAY):
+        logger.info(f"{procStats.rss_kib() / 1024:.1f} MiB RSS for {len(services)} services")
+        wakeup.wait_any([stop])
+    logger.info("Stopping services")
+    for service in services:
+        service.stop()
+    deadline = time.monotonic() + STOP_TIMEOUT
+    for service in services:
+        if service.on_stop is not None:
+            service.thread.join(max(0.0, deadline - time.monotonic()))
+    stop.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.DEBUG,
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+    main(sys.argv[1:])
@@ -0,0 +1,181 @@
+from blend import box_intersection, region
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+import collections
+import logging
+import numpy
+import os
+
+logger = logging.getLogger(__name__)
+
+FONT = os.environ.get("PIRATE_ALARM_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+# Rendered strips to keep, a clock needs one per distinct time shown so this covers the last half hour of them
+STRIP_CACHE_SIZE = 32
+
+
+class GlyphAtlas:
+    """Each character of one font at one size, rasterised once into a coverage mask the height of a line."""
+
+    def __init__(self, path, size):
+        self.font = ImageFont.truetype(path, size)
+        ascent, descent = self.font.getmetrics()
+        self.height = ascent + descent
+        # char: (coverage, left bearing, advance)
+        self.glyphs = dict()
+
+    def glyph(self, char):
+        if char not in self.glyphs:
+            # Drawn from the ascender line, so every glyph lands on the same baseline when pasted at y=0
+            left, _, right, _ = self.font.getbbox(char, anchor="la")
+            mask = Image.new("L", (max(1, right - left), self.height))
+            ImageDraw.Draw(mask).text((-left, 0), char, font=self.font, fill=255, anchor="la")
+            self.glyphs[char] = (numpy.asarray(mask), left, round(self.font.getlength(char)))
+        return self.glyphs[char]
+
+    def render(self, text):
+        """Coverage mask for a line of text, put together from cached glyphs without going back to FreeType."""
+        glyphs = [self.glyph(char) for char in text]
+        # Where each glyph's mask starts, relative to the pen starting at 0
+        starts = []
+        pen = 0
+        for _, left, advance in glyphs:
+            starts.append(pen + left)
+            pen += advance
+        # Wide enough for the last glyph's overhang past its advance, anything left of the pen's start is cropped
+        right = max((start + mask.shape[1] for start, (mask, _, _) in zip(starts, glyphs)), default=0)
+        strip = numpy.zeros((self.height, max(1, pen, right)), dtype=numpy.uint8)
+        for start, (mask, _, _) in zip(starts, glyphs):
+            x0 = max(0, start)
+            x1 = start + mask.shape[1]
+            if x1 > x0:
+                region = strip[:, x0:x1]
+                numpy.maximum(region, mask[:, x0 - start :], out=region)
+        return strip
+
+
+class TextItem:
+    def __init__(self, strip, x, y, speed=0, start=0.0):
+        self.strip = strip
+        self.x = x
+        self.y = y
+        # Pixels per second a ticker moves left, 0 for text that stays put
+        self.speed = speed
+        self.start = start
+
+    def box(self):
+        return (self.x, self.y, self.x + self.strip.shape[1], self.y + self.strip.shape[0])
+
+
+class TextLayer:
+    """
+    Named pieces of text over the background. Each is rendered once into a premultiplied RGBA strip, so a clock
+    changing its digits or a ticker moving along costs a blend of the strip rather than laying out and rasterising
+    the string.
+    """
+
+    def __init__(self, width, height, blender, font=FONT):
+        self.width = width
+        self.height = height
+        self.blender = blender
+        self.font = font
+        self.pixels = numpy.zeros((height, width, 4), dtype=numpy.uint8)
+        self.items = dict()
+        # Names of the items that move, read by the render thread without the lock to decide whether to wake up
+        self.tickers = set()
+        self.atlases = dict()
+        self.strips = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def atlas(self, size):
+        if size not in self.atlases:
+            self.atlases[size] = GlyphAtlas(self.font, size)
+        return self.atlases[size]
+
+    def strip(self, text, size, color):
+        key = (text, size, color)
+        if key in self.strips:
+            self.hits += 1
+            self.strips.move_to_end(key)
+            return self.strips[key]
+
+        self.misses += 1
+        coverage = self.atlas(size).render(text)
+        rgba = ImageColor.getrgb(color)
+        alpha = rgba[3] if len(rgba) == 4 else 255
+        # Premultiplied, so every channel is just the colour scaled by coverage
+        strip = numpy.empty(coverage.shape + (4,), dtype=numpy.uint8)
+        coverage = coverage.astype(numpy.uint32)
+        for channel, value in enumerate(rgba[:3]):
+            strip[..., channel] = (coverage * (value * alpha // 255) + 127) // 255
+        strip[..., 3] = (coverage * alpha + 127) // 255
+
+        self.strips[key] = strip
+        if len(self.strips) > STRIP_CACHE_SIZE:
+            self.strips.popitem(last=False)
+        return strip
+
+    def screen_box(self, item):
+        box = item.box()
+        if item.speed:
+            # A ticker's whole row changes every frame, damage it as one band that stays the same box
+            box = (0, box[1], self.width, box[3])
+        return box_intersection(box, (0, 0, self.width, self.height))
+
+    def set_item(self, name, item):
+        """Add or replace an item, returns the boxes that need redrawing."""
+        damage = [self.screen_box(self.items[name])] if name in self.items else []
+        self.items[name] = item
+        if item.speed:
+            self.tickers.add(name)
+        else:
+            self.tickers.discard(name)
+        damage.append(self.screen_box(item))
+        return [box for box in damage if box is not None]
+
+    def draw_text(self, name, text, x, y, size, color):
+        return self.set_item(name, TextItem(self.strip(text, size, color), x, y))
+
+    def scroll_text(self, name, text, y, size, color, speed, now):
+        # Starts just off the right edge
+        return self.set_item(name, TextItem(self.strip(text, size, color), self.width, y, speed, now))
+
+    def clear_text(self, name):
+        if name not in self.items:
+            return []
+        self.tickers.discard(name)
+        box = self.screen_box(self.items.pop(name))
+        return [box] if box is not None else []
+
+    def scrolling(self):
+        return bool(self.tickers)
+
+    def advance(self, now):
+        """Move every ticker to where it should be at now, returns the boxes that need redrawing."""
+        damage = []
+        for name in self.tickers:
+            item = self.items[name]
+            # Once it has scrolled off the left it comes back in from the right
+            travel = int((now - item.start) * item.speed) % (item.strip.shape[1] + self.width)
+            x = self.width - travel
+            if x != item.x:
+                item.x = x
+                damage.append(self.screen_box(item))
+        return [box for box in damage if box is not None]
+
+    def redraw(self, box):
+        """Rebuild the layer inside box from the strips, only the visible slice of each is blended."""
+        region(self.pixels, box).fill(0)
+        for item in self.items.values():
+            visible = box_intersection(item.box(), box)
+            if visible is None:
+                continue
+            target = region(self.pixels, visible)
+            self.blender.over(region(item.strip, visible, (item.x, item.y)), target, target)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "strips": len(self.strips),
+            "glyphs": sum(len(atlas.glyphs) for atlas in self.atlases.values()),
+        }
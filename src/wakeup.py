@@ -0,0 +1,56 @@
+import os
+import select
+import threading
+
+
+class WakeEvent(threading.Event):
+    """
+    A threading.Event that select() and zmq.Poller can also wait on, through a pipe that's readable exactly while the
+    event is set. This lets a thread block on a socket and a shutdown request together instead of polling both.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        os.set_blocking(self.write_fd, False)
+        # Keeps the pipe and the flag in step when set() and clear() race
+        self.fd_lock = threading.Lock()
+
+    def fileno(self):
+        return self.read_fd
+
+    def set(self):
+        with self.fd_lock:
+            was_set = self.is_set()
+            # Flag first: a waiter woken by the pipe must find the event set, or it spins until this thread runs again
+            super().set()
+            if not was_set and self.write_fd is not None:
+                os.write(self.write_fd, b"\0")
+
+    def clear(self):
+        with self.fd_lock:
+            if self.read_fd is not None:
+                try:
+                    while os.read(self.read_fd, 64):
+                        pass
+                except BlockingIOError:
+                    pass
+            super().clear()
+
+    def close(self):
+        # Once closed it's a plain threading.Event, so a late set() from another thread can't write to a reused fd
+        with self.fd_lock:
+            if self.read_fd is None:
+                return
+            os.close(self.read_fd)
+            os.close(self.write_fd)
+            self.read_fd = self.write_fd = None
+
+
+def wait_any(events, timeout=None):
+    """Block until any of the events is set or timeout seconds pass, returns whether one was set."""
+    if any(event.is_set() for event in events):
+        return True
+    readable, _, _ = select.select(events, [], [], timeout)
+    return bool(readable)
@@ -1,8 +1,81 @@
-DISPLAY_SERVER_ADDR = "tcp://localhost:5555"
-DISPLAY_CLIENT_FILTER = "tcp://*:5555"
+import os
+import sys
+import zmq
 
-BUTTON_PUB = "tcp://*:5566"
-BUTTON_SUB = "tcp://localhost:5566"
+# Every socket between our services is one of these endpoints. Where each one lives is resolved here, callers only
+# ever bind() or connect() by name.
+PORTS = {
+    "display": 5555,
+    "button": 5566,
+    "raylib_button": 5577,
+    # Only used by benchTransport.py
+    "bench": 5599,
+    # Metrics, one per daemon, only bound when PIRATE_ALARM_METRICS=1, see stats_endpoint()
+    "stats_display": 5601,
+    "stats_button": 5602,
+    "stats_wifi": 5603,
+    "stats_humidifier": 5604,
+    "stats_supervisor": 5605,
+    "stats_alarm": 5606,
+}
+STATS_SERVICES = tuple(endpoint.removeprefix("stats_") for endpoint in PORTS if endpoint.startswith("stats_"))
 
-RAYLIB_SIM_BUTTON_PUB = "tcp://*:5577"
-RAYLIB_SIM_BUTTON_SUB = "tcp://localhost:5577"
+# ipc:// Unix sockets skip the TCP loopback stack, so they're the default wherever they exist. tcp:// is there for
+# debugging from another machine: run the servers and the remote client with PIRATE_ALARM_TRANSPORT=tcp and point the
+# client at the Pi with PIRATE_ALARM_HOST. inproc:// is used between services sharing a process, see supervisor.py.
+TRANSPORTS = ("ipc", "tcp", "inproc")
+LOCAL_TRANSPORT = "ipc" if sys.platform == "linux" else "tcp"
+TRANSPORT = os.environ.get("PIRATE_ALARM_TRANSPORT", LOCAL_TRANSPORT)
+HOST = os.environ.get("PIRATE_ALARM_HOST", "localhost")
+IPC_DIR = os.environ.get("PIRATE_ALARM_IPC_DIR", "/tmp/pirate-alarm")
+assert TRANSPORT in TRANSPORTS
+
+# Set by use_inproc() when every service shares one process
+inproc_enabled = False
+
+
+def bind_address(endpoint, transport):
+    if transport == "ipc":
+        return f"ipc://{IPC_DIR}/{endpoint}.sock"
+    if transport == "tcp":
+        return f"tcp://*:{PORTS[endpoint]}"
+    return f"inproc://{endpoint}"
+
+
+def connect_address(endpoint, transport):
+    if transport == "tcp":
+        return f"tcp://{HOST}:{PORTS[endpoint]}"
+    return bind_address(endpoint, transport)
+
+
+def stats_endpoint(service):
+    return f"stats_{service}"
+
+
+def context():
+    """The process wide context. inproc:// endpoints are only reachable from sockets made by the same context."""
+    return zmq.Context.instance()
+
+
+def use_inproc():
+    """Switch in-process clients over to inproc://, must be called before any service creates its sockets."""
+    global inproc_enabled
+    inproc_enabled = True
+
+
+def bind(socket, endpoint):
+    """
+    Bind the local transport, so clients using the default can always connect, plus the configured one if that
+    differs, and inproc:// when co-hosted.
+    """
+    transports = {LOCAL_TRANSPORT, TRANSPORT}
+    if inproc_enabled:
+        transports.add("inproc")
+    if "ipc" in transports:
+        os.makedirs(IPC_DIR, exist_ok=True)
+    for transport in sorted(transports):
+        socket.bind(bind_address(endpoint, transport))
+
+
+def connect(socket, endpoint):
+    socket.connect(connect_address(endpoint, "inproc" if inproc_enabled else TRANSPORT))